@@ -0,0 +1,197 @@
+"""
+admission.py – Admission control in front of the LLM.
+
+Every interviewer turn goes through `admission`:
+
+* `turn(user_id, key, fn)` allows one turn per user at a time.  A resend of the
+  same request (same key) while it is running, or up to
+  ADMISSION_DUPLICATE_GRACE seconds after it finished, gets the same response
+  instead of a second turn; a different request from a user whose turn is still
+  running is turned away.  A finished turn stops being replayed as soon as the
+  user starts another one, and `replay=False` (used by /start) shares a turn
+  only while it is in flight.
+* `slot(estimate)` bounds the LLM calls in progress (interviewer turns, /start
+  intro summaries on a cache miss and stage summaries) to ADMISSION_MAX_CONCURRENT.
+  Callers beyond that wait in FIFO order (one entry per user, so nobody can
+  crowd others out) for at most ADMISSION_QUEUE_TIMEOUT seconds.  With
+  ADMISSION_TPM set, the call's estimated tokens are also taken from a
+  tokens-per-minute bucket.
+
+When the queue is full, the token budget is spent or a user already has a turn
+running, Overloaded is raised straight away with a Retry-After estimate and the
+app answers 429, so callers don't wait only to time out.
+"""
+
+import asyncio, math, os, time
+from collections import deque
+from contextlib import asynccontextmanager
+import metrics
+from singleflight import SingleFlight
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+ADMISSION_TPM = int(os.getenv("ADMISSION_TPM", "0"))                      # 0 = no token budget
+ADMISSION_DUPLICATE_GRACE = float(os.getenv("ADMISSION_DUPLICATE_GRACE", "5"))
+# Rough characters per token for the up-front estimate (the exact count comes back with the reply)
+CHARS_PER_TOKEN = 4
+# Seconds a call is assumed to take until some have been timed
+INITIAL_SERVICE_TIME = 2.0
+
+ADMISSION_REJECTED = metrics.register(metrics.Counter("admission_rejected_total", "Requests answered 429 by admission control, by reason."))
+ADMISSION_WAIT = metrics.register(metrics.Histogram("admission_wait_seconds", "Time LLM calls spent queued for a slot."))
+ADMISSION_DUPLICATES = metrics.register(metrics.Counter("admission_duplicates_total", "Resent requests served by the turn already in flight."))
+
+
+class Overloaded(Exception):
+    """The request was not admitted; retry after `retry_after` seconds."""
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Server busy ({reason})")
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    """Upper-bound guess of a call's token use: the prompt by length plus the full reply allowance."""
+    return sum(len(m["content"]) for m in messages) // CHARS_PER_TOKEN + max_tokens
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, tpm: int = ADMISSION_TPM,
+                 duplicate_grace: float = ADMISSION_DUPLICATE_GRACE):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tpm = tpm
+        self.active = 0
+        self.service_time = INITIAL_SERVICE_TIME   # moving average of how long a slot is held
+        self.tokens = float(tpm)
+        self._refilled = time.monotonic()
+        self._queue = deque()    # futures of calls waiting for a slot, oldest first
+        self._turns = {}         # user_id -> flight key of the user's latest turn
+        self._replays = {}       # user_id -> flight key of a finished turn still replayed to resends
+        self._streams = set()    # users with a streamed turn running
+        self._flights = SingleFlight(duplicate_grace)
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    # ---------------------------------------------------------------- budget
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.tpm, self.tokens + (now - self._refilled) * self.tpm / 60)
+        self._refilled = now
+
+    def _reject(self, reason: str, retry_after: float):
+        ADMISSION_REJECTED.inc(reason=reason)
+        raise Overloaded(reason, retry_after)
+
+    def check(self, estimate: int = 0):
+        """Raise Overloaded if a call of `estimate` tokens would be turned away right now."""
+        if len(self._queue) >= self.max_queue:
+            self._reject("queue full", self.service_time * (len(self._queue) + 1) / self.max_concurrent)
+        if self.tpm:
+            self._refill()
+            need = min(estimate, self.tpm)
+            if need > self.tokens:
+                self._reject("token budget", (need - self.tokens) * 60 / self.tpm)
+
+    # ---------------------------------------------------------------- slots
+    def _release(self):
+        while self._queue:
+            waiter = self._queue.popleft()
+            if not waiter.done():
+                waiter.set_result(None)   # hand the slot straight to the oldest waiter
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, estimate: int = 0):
+        """Hold one of the concurrent LLM call slots (and `estimate` tokens of the budget) for the block."""
+        self.check(estimate)
+        spent = min(estimate, self.tpm) if self.tpm else 0
+        self.tokens -= spent
+        queued_at = time.monotonic()
+        if self.active < self.max_concurrent and not self._queue:
+            self.active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._queue.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, self.queue_timeout)
+            except BaseException as err:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()   # the slot arrived just as we gave up: pass it on
+                elif waiter in self._queue:
+                    self._queue.remove(waiter)
+                self.tokens += spent
+                if isinstance(err, asyncio.TimeoutError):
+                    self._reject("queue timeout", self.service_time)
+                raise
+        ADMISSION_WAIT.observe(time.monotonic() - queued_at)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.service_time = 0.8 * self.service_time + 0.2 * (time.monotonic() - started)
+            self._release()
+
+    # ---------------------------------------------------------------- per user
+    def _busy(self, user_id: str, flight: str = None) -> bool:
+        if user_id in self._streams:
+            return True
+        current = self._turns.get(user_id)
+        return current is not None and current != flight and self._flights.running(current)
+
+    def check_user(self, user_id: str, flight: str = None):
+        if self._busy(user_id, flight):
+            self._reject("turn in progress", self.service_time)
+
+    def _new_turn(self, user_id: str, flight: str = None):
+        """Another turn is starting, so the user's last result no longer answers a resend."""
+        replayed = self._replays.pop(user_id, None)
+        if replayed is not None and replayed != flight:
+            self._flights.forget(replayed)
+
+    def _end_replay(self, user_id: str, flight: str):
+        if self._replays.get(user_id) == flight:
+            del self._replays[user_id]
+
+    async def turn(self, user_id: str, key: str, fn, replay: bool = True):
+        """
+        Await fn() as the user's only turn; a resend with the same key shares the running turn, or
+        with `replay` its result for a short while after it finished (until the user's next turn).
+        """
+        flight = f"{user_id}\0{key}"
+        self.check_user(user_id, flight)
+        self._new_turn(user_id, flight)
+        self._turns[user_id] = flight
+        try:
+            result, shared = await self._flights.do(flight, fn, grace=None if replay else 0)
+        finally:
+            # The last caller to leave clears the entry, cancelled or not: when it was cancelled the
+            # shared call is being cancelled with it, so waiting for the call to finish would leave it stale
+            if self._turns.get(user_id) == flight and not self._flights.waiters(flight):
+                del self._turns[user_id]
+                if self._flights.finished(flight):
+                    self._replays[user_id] = flight
+                    asyncio.get_running_loop().call_later(self._flights.grace, self._end_replay, user_id, flight)
+        if shared:
+            ADMISSION_DUPLICATES.inc()
+        return result
+
+    def claim_stream(self, user_id: str):
+        """Mark a streamed turn, which can't be shared with a resend, as the user's only turn until release_stream."""
+        self.check_user(user_id)
+        self._new_turn(user_id)
+        self._streams.add(user_id)
+
+    def release_stream(self, user_id: str):
+        self._streams.discard(user_id)
+
+
+admission = AdmissionController()
+metrics.register(metrics.Gauge("admission_active", "LLM calls holding an admission slot.", lambda: admission.active))
+metrics.register(metrics.Gauge("admission_queued", "LLM calls waiting for an admission slot.", lambda: admission.queued))
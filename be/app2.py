@@ -1,165 +1,124 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from typing import Optional
-import json
+from contextlib import asynccontextmanager
+import asyncio, json, re
 from pathlib import Path
-import os, re
-from openai import OpenAI, OpenAIError
-from textwrap import dedent
+import os
+from openai import OpenAIError
 from dotenv import load_dotenv
-from fastapi.responses import PlainTextResponse
-app = FastAPI()
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+load_dotenv()
+from template_registry import registry, clean_whitespace
+from context import ContextState, build_context, condense, count_message_tokens
+from prompts import STAGES, INTRO_PROMPT, REFERENCE_INDEX, REFERENCE_SUFFIX, stage_prefix
+from retrieval import RETRIEVAL_TOP_K, retrieve
+from diagram_scoring import DIAGRAM_SCORING, coverage
+from diagram import canonicalize, normalize_elements, elements_key, encode as encode_diagram, diff as diff_diagram
+from session_store import ArchivedHistory, remove_spill_dir, SESSION_SWEEP_INTERVAL
+from shared_sessions import SESSION_BACKEND, SessionConflict, open_session_store
+from intro_cache import intro_cache, content_hash
+import metrics
+from llm import MODEL, complete, stream, cancel_on_disconnect, ClientDisconnected
+from resilience import DeadlineExceeded, CircuitOpen
+from admission import admission, Overloaded, estimate_tokens
+from singleflight import call_key
+from response_cache import RESPONSE_CACHE, RESPONSE_CACHE_STAGES, response_cache, scope_key
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Parse and normalise every template once before serving traffic
+    # Retrieval and diagram-scoring indexes are built per (problem, stage) on first use, so bundled stages stay undecoded
+    registry.preload()
+    sweeper = asyncio.create_task(_sweep_sessions())
+    prewarm = asyncio.create_task(_prewarm_intro_cache()) if INTRO_CACHE_PREWARM else None
+    yield
+    sweeper.cancel()
+    if prewarm is not None:
+        prewarm.cancel()
+    if SESSION_BACKEND == "memory":
+        remove_spill_dir()  # sessions don't outlive the process; other workers' directories are theirs to remove
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
 )
-load_dotenv()
+app.add_middleware(metrics.RequestMetricsMiddleware)
 auth_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI()
-
-# Standardized interview stages (in order)
-STAGES = ["Understanding the Problem", "The Set Up", "High-Level Design", "Potential Deep Dives"]
-
-STAGE_PROMPTS = {
-    "Understanding the Problem": """
-**Stage 1 - Understanding the Problem**
-Goals
-• List and clarify **functional requirements** ("what the system must do").
-• List and clarify **non-functional requirements** (latency, throughput, scale, SLA, consistency, availability, cost, security…).
-• Surface ambiguities & assumptions; decide what is explicitly *out of scope*.
-• Quantify key NFRs with ballpark numbers if possible (QPS, p99 latency, data size, traffic growth).
-
-Interviewer checklist
-1. Ask the candidate to restate the problem in their own words.
-2. Elicit functional requirements with open questions ("What should users be able to do?"). Probe edge-cases.
-3. Switch to NFRs: latency, scale, consistency, availability, durability, cost.
-4. Push for concrete numbers (or reasonable estimates) that drive design decisions.
-5. Confirm scope & assumptions; summarise and get explicit agreement before moving on.
-""",
-
-    "The Set Up": """
-**Stage 2 - The Set Up**
-Goals
-• Identify core **entities / data objects** and their high-level attributes.
-• Define the main **APIs / operations** needed to satisfy functional requirements.
-• Mark system boundaries & external dependencies (auth, payments, 3rd-party services).
-• Optionally outline a rough step-by-step plan for tackling the design.
-
-Interviewer checklist
-1. Prompt for key nouns → entities. Capture concise definitions.
-2. Prompt for key verbs → API endpoints or RPCs. Cover CRUD & special ops.
-3. Ask which responsibilities are handled inside vs outside (e.g. authentication, email, push notifications).
-4. Ensure every functional requirement from Stage 1 maps to at least one API.
-5. Summarise entities & APIs; confirm completeness with the candidate before proceeding.
-""",
-
-    "High-Level Design": """
-**Stage 3 - High-Level Design**
-Goals
-• Sketch the architecture: major components/services, data stores, caches, queues.
-• Describe data-flow for key operations end-to-end.
-• Select technologies/types (SQL vs NoSQL, message broker, CDN, etc.) and justify briefly.
-• Show how the design meets the stated functional & primary non-functional requirements.
-• Highlight major trade-offs and alternatives.
-
-Interviewer checklist
-1. Ask candidate to enumerate components; probe each for responsibility.
-2. Walk through a core user request - which component does what?
-3. Check that the design provides stated latency/throughput/availability targets (point to cache, replicas, etc.).
-4. Introduce missing standard pieces via questions (load-balancer, cache, etc.).
-5. Summarise the architecture; ensure all requirements are addressed before deep dives.
-""",
-
-    "Potential Deep Dives": """
-**Stage 4 - Potential Deep Dives**
-Goals
-• Investigate 1-2 challenging areas in detail (scaling reads/writes, sharding, consistency model, fault-tolerance, security, etc.).
-• Discuss algorithms, data-partitioning strategy, replication & failover, index design, caching strategy, quotas, back-pressure, etc.
-• Analyse failure modes, trade-offs, and capacity limits.
-• Demonstrate depth of understanding and practical decision-making.
-
-Interviewer checklist
-1. Pick the most critical bottleneck or risk; ask the candidate to propose solutions.
-2. Push on edge-cases, race-conditions, failure scenarios. Ask for mitigation.
-3. Compare multiple approaches (e.g. consistent hashing vs range partitioning).
-4. If time permits, tackle a second deep-dive area (security, cost optimisation, migrations…).
-5. Wrap up by summarising the improved design and remaining open questions.
-""",
-}
-
-INTERVIEWER_BEHAVIOR_PROMPT = """
-You are a **professional System-Design Interviewer AI**.  You simulate a real FAANG/
-tier-1 interviewer in a mock interview.  You **always** run the conversation in
-**four sequential stages** and **never skip ahead**:
-
-1. **Understanding the Problem** - Clarify every functional & non-functional
-   requirement; push for concrete numbers; confirm in/out-of-scope.
-2. **The Set Up** - Identify core entities and main APIs; define system boundaries;
-   establish the shared vocabulary for the design.
-3. **High-Level Design** - Lay out the architecture: components, data-flow,
-   technology choices, trade-offs, how the design satisfies the requirements.
-4. **Potential Deep Dives** - Pick 1-2 challenging areas (scalability,
-   consistency, fault-tolerance, security, etc.) and explore them in depth,
-   analysing algorithms, data-partitioning, failure modes, trade-offs.
-
-**Behaviour rules**
-• Plan silently first: recall the stage goals, think, then reply.
-• Stay strictly on the **current stage**; gently refuse to answer out-of-stage
-  questions ("Let's finish X before we tackle Y").
-• Guide with **questions & hints**, not full answers.  Encourage the candidate
-  to reason aloud; nudge if they are stuck.
-• If the candidate omits a critical point, ask an open question to surface it.
-• Before advancing a stage, **summarise** what has been achieved and explicitly
-  confirm agreement with the candidate.
-• If you want to proceed to the next stage, say "next stage" or "move on to stage". Specifically when you are done with the current stage and form now on you will be asking questions to the candidate from the next stage.
-• Maintain a friendly, supportive tone.  Your goal is to help the candidate
-  think deeply, demonstrate structured reasoning, and cover trade-offs.
-"""
-
-# In-memory storage for session states keyed by user_id
-sessions: dict = {}
+# Generate missing intro summaries for every template in the background at boot
+INTRO_CACHE_PREWARM = os.getenv("INTRO_CACHE_PREWARM", "1") == "1"
+# Interviewer turns come back as one JSON object carrying the stage decision and summary (see TurnOutput)
+STRUCTURED_TURNS = os.getenv("STRUCTURED_TURNS", "0") == "1"
 
 class SessionState:
     """Tracks the interview state for a user, including current stage and problem-specific data."""
-    def __init__(self, problem_name: str):
+    def __init__(self, problem_name: str, archive: ArchivedHistory = None):
         self.problem_name = problem_name
         self.stage_index = 0  # Start at the first stage (index 0 in STAGES)
-        self.history = []     # Conversation history: list of {"role": ..., "content": ...} messages
-        self.allHistory = []
+        self.history = []     # Conversation history: list of {"role": ..., "content": ...} messages, already cleaned
+        self.allHistory = archive if archive is not None else ArchivedHistory()  # Finished stage transcripts
         self.problem_data = self._load_problem_data(problem_name)
+        self.context = ContextState()  # Condensed digest of older turns in the current stage
+        self.diagram = None         # Last canonical diagram the model has seen
+        self.diagram_anchor = None  # history index of the user message that carried it in full
+        self.diagram_cache = None   # (elements_key, canonical diagram) of the last raw element list
+        self.summary_stage = None   # allHistory index whose summary still has to open this stage
+        self.pending_summary = None # Background task writing that summary (only in the worker that started it)
+        self.version = None         # Store version this copy was loaded at (shared session backends)
     
-    def clean_string(self, s: str) -> str:
-        # 1) Dedent and trim
-        text = dedent(s).strip()
-        # 2) Collapse internal spaces/tabs (but keep newlines)
-        #    Replace two or more spaces/tabs with one space
-        text = re.sub(r"[ \t]{2,}", " ", text)
-        # 3) Collapse multiple blank lines to a single newline
-        text = re.sub(r"\n{2,}", "\n", text)
-        return text
-
-    def clean_whitespace(self, obj):
-        if isinstance(obj, str):
-            return self.clean_string(obj)
-        elif isinstance(obj, list):
-            return [self.clean_whitespace(item) for item in obj]
-        elif isinstance(obj, dict):
-            return {k: self.clean_whitespace(v) for k, v in obj.items()}
-        else:
-            return obj
+    def to_dict(self) -> dict:
+        """Everything needed to rebuild the session in another worker; template data is looked up again."""
+        return {
+            "problem": self.problem_name,
+            "stage": self.stage_index,
+            "history": self.history,
+            "archive": {"key": self.allHistory.key, "len": len(self.allHistory)},
+            "context": [self.context.folded, self.context.lines, self.context.costs],
+            "diagram": [self.diagram, self.diagram_anchor],
+            "summary_stage": self.summary_stage,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, archive: ArchivedHistory) -> "SessionState":
+        session = cls(data["problem"], archive)
+        session.stage_index = data["stage"]
+        session.history = data["history"]
+        session.context.folded, session.context.lines, session.context.costs = data["context"]
+        session.diagram, session.diagram_anchor = data["diagram"]
+        session.summary_stage = data["summary_stage"]
+        return session
     
-    def _load_problem_data(self, problem_name: str) -> dict:
-        """Load problem-specific template data from a JSON file."""
-        # Try loading from current directory or a 'problems' subdirectory
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
-        path = os.path.join(TEMPLATES_DIR, f"{problem_name}.json")
-        if not os.path.exists(path):
-            raise FileNotFoundError(f"Template {problem_name} not found")
-        json_data = json.load(open(path, "r"))
-        return self.clean_whitespace(json_data)
+    def _load_problem_data(self, problem_name: str):
+        """Fetch the shared, already-cleaned template data for this problem (read-only)."""
+        with metrics.span("template_load"):
+            return registry.get(problem_name)
+    
+    def describe_diagram(self, diagram: dict):
+        """
+        Text for a canonical diagram and whether it is the full encoding. Only the delta against the
+        last diagram is sent while the message that carried that one in full is still verbatim in history.
+        """
+        if self.diagram is None or self.diagram_anchor is None or self.diagram_anchor < self.context.folded:
+            return encode_diagram(diagram), True
+        return diff_diagram(self.diagram, diagram), False
+
+    def normalize(self, elements: list) -> dict:
+        """Canonical diagram for raw Excalidraw elements, reusing the last result if nothing was edited."""
+        key = elements_key(elements)
+        if self.diagram_cache is None or self.diagram_cache[0] != key:
+            with metrics.span("diagram_normalize"):
+                self.diagram_cache = (key, normalize_elements(elements))
+        return self.diagram_cache[1]
+
+    def record_diagram(self, diagram: dict, full: bool):
+        """Remember the diagram sent with the user message about to be appended to history."""
+        if full:
+            self.diagram_anchor = len(self.history)
+        self.diagram = diagram
     
     def current_stage_name(self) -> str:
         """Get the name of the current interview stage."""
@@ -169,47 +128,182 @@ class SessionState:
         """Move to the next stage of the interview, if possible."""
         if self.stage_index < len(STAGES) - 1:
             self.stage_index += 1
+            self.context.reset()
+            self.diagram_anchor = None  # the new stage's history no longer contains the full diagram
         else:
             # If already at the last stage, we do nothing or raise (here we raise to indicate misuse)
             raise HTTPException(status_code=400, detail="Already at the final stage; cannot advance further.")
     
+    async def resolve_summary(self):
+        """
+        Wait for the previous stage's summary if it is still being written, then put it at the head
+        of the current stage's history. A no-op once the summary is in place.
+        """
+        stage = self.summary_stage
+        if stage is None:
+            return
+        task = self.pending_summary
+        summary = None
+        if task is not None:
+            try:
+                # Shielded so a cancelled request doesn't cancel the summary other requests are waiting on
+                summary = await asyncio.shield(task)
+            except Exception as err:
+                print("Stage summary failed:", err)
+        else:
+            # Started by another worker (or before this copy was loaded): it lands in the archive
+            summary = await self.allHistory.wait_summary(stage)
+        if summary is None:
+            summary = "\n".join(condense(m) for m in (await self.allHistory.fetch(stage))[-6:])
+        if self.summary_stage == stage:
+            self.summary_stage = None
+            self.pending_summary = None
+            self.history.insert(0, {"role": "assistant", "content": clean_whitespace(f"**Summary so far:** {summary}")})
+    
     def at_final_stage(self) -> bool:
         """Check if the session is at the last stage."""
         return self.stage_index >= len(STAGES) - 1
 
-def assemble_messages(session: SessionState, user_message: str) -> list:
+# Session states keyed by user_id: in this process (idle/LRU/memory-bounded) or in a shared backend
+sessions = open_session_store(SessionState.from_dict)
+metrics.register(metrics.Gauge("active_sessions", "Interview sessions in the session store.", lambda: len(sessions)))
+metrics.register(metrics.Gauge("history_bytes", "Estimated bytes of in-memory conversation history.", lambda: sessions.total_bytes))
+
+async def _sweep_sessions():
+    """Periodically evict idle sessions so memory is reclaimed even without traffic (this also refreshes the shared count)."""
+    while True:
+        await sessions.sweep()
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+
+async def _save_session(user_id: str, session: SessionState):
+    """Persist a finished turn; a concurrent turn on the same session that saved first wins."""
+    try:
+        await sessions.save(user_id, session)
+    except SessionConflict:
+        raise HTTPException(status_code=409, detail="This session was updated by another request. Please resend your message.")
+
+def assemble_messages(session: SessionState, user_message: str, structured: bool = False,
+                      diagram: Optional[dict] = None) -> list:
     """
     Build the message list for the OpenAI API given the session state and new user input.
-    This includes the global prompt, stage prompt, problem-specific context, prior history, and the user message.
+    The memoised static prefix (global prompt, stage prompt, problem-specific context) comes first,
+    followed by prior history and the user message fitted into the per-request token budget
+    (older turns are folded into a condensed digest). `diagram` is the canonical diagram sent
+    with this message, if any; otherwise the last one the model saw is used.
     """
-    messages = []
-    stage_name = session.current_stage_name()
-    # 1. Global interviewer behavior system prompt
-    messages.append({"role": "system", "content": INTERVIEWER_BEHAVIOR_PROMPT})
-    # 2. Stage-specific instructions as another system prompt
-    if stage_name in STAGE_PROMPTS:
-        messages.append({"role": "system", "content": f"**Stage: {stage_name}** - {STAGE_PROMPTS[stage_name]}"})
-    else:
-        messages.append({"role": "system", "content": f"Stage: {stage_name}"})
-    # 3. Problem-specific content for the current stage (if any)
-    messages.append({"role": "system", "content": f"**Example answer:** {session.problem_data[stage_name]} above answer contains more data then the user can handle, so you need to ask follow up questions to the candidate to understand the problem better."})
-    # 4. Add prior conversation history (all user and assistant messages so far)
-    for msg in session.history:
-        messages.append(session.clean_whitespace(msg))
-    # 5. Finally, add the new user message
-    messages.append({"role": "user", "content": session.clean_whitespace(user_message)})
+    with metrics.span("assemble_messages"):
+        stage_name = session.current_stage_name()
+        diagram = diagram or session.diagram
+        # 1-3. Global, stage and problem-specific system prompts, identical for every user on this (problem, stage)
+        prefix = stage_prefix(session.problem_name, stage_name, full_reference=not RETRIEVAL_TOP_K, structured=structured)
+        # Where the example answer sits: the only system message build_context may trim
+        reference_at = REFERENCE_INDEX
+        if RETRIEVAL_TOP_K:
+            # Only the reference chunks relevant to this message and the current diagram
+            with metrics.span("retrieval"):
+                labels = " ".join(diagram["nodes"].values()) if diagram else ""
+                reference = retrieve(session.problem_name, stage_name, f"{user_message}\n{labels}")
+            reference_at = len(prefix)
+            prefix += ({"role": "system", "content": f"**Example answer (most relevant parts):**\n{reference}\n\n{REFERENCE_SUFFIX}"},)
+        if DIAGRAM_SCORING and diagram:
+            # Precomputed comparison of the candidate's diagram with the example answer's figures
+            with metrics.span("diagram_scoring"):
+                findings = coverage(session.problem_name, stage_name, diagram)
+            if findings:
+                prefix += ({"role": "system", "content": f"**Diagram check against the example answer (computed locally, not shown to the candidate):**\n{findings}"},)
+        # 4. Prior conversation history (recent turns verbatim, older ones condensed) and the new user message.
+        #    Everything was cleaned when it entered the session, so nothing is re-cleaned or re-counted here.
+        user = {"role": "user", "content": user_message}
+        messages = build_context(prefix, session.history, user, session.context, reference=reference_at)
+    prompt_chars = sum(len(m["content"]) for m in messages)
+    prompt_tokens = count_message_tokens(messages)
+    metrics.PROMPT_CHARS.observe(prompt_chars)
+    metrics.PROMPT_TOKENS.observe(prompt_tokens)
+    metrics.annotate(prompt_chars=prompt_chars, prompt_tokens_local=prompt_tokens, stage=stage_name)
     return messages
 
 # Pydantic model for incoming user messages (candidate's input)
 class UserInput(BaseModel):
     user_id: str
     message: str
-    graph: Optional[dict] = None
+    graph: Optional[dict] = None      # processData graph (older clients)
+    elements: Optional[list] = None   # raw Excalidraw elements, normalized server-side
+
+# Structured interviewer turn (STRUCTURED_TURNS=1)
+class TurnOutput(BaseModel):
+    reply: str
+    advance_stage: bool = False
+    rolling_summary: str = ""     # only filled in when advance_stage is true
+
+def parse_turn(text: str) -> Optional[TurnOutput]:
+    """Validate a structured turn, tolerating a code fence or prose around the JSON; None if it isn't one."""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        turn = TurnOutput.model_validate_json(text[start:end + 1])
+    except ValidationError:
+        return None
+    return turn if turn.reply.strip() else None
+
+class ReplyStream:
+    """
+    Picks the "reply" string out of a structured turn while its JSON is still arriving, so the
+    stream can show the reply and nothing else. feed() returns the newly decoded reply text;
+    an escape split across deltas waits for its next delta.
+    """
+    _START = re.compile(r'"reply"\s*:\s*"')
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self.raw = ""
+        self._pos = None     # next undecoded character of the reply string
+        self._done = False
+
+    def feed(self, delta: str) -> str:
+        self.raw += delta
+        if self._done:
+            return ""
+        if self._pos is None:
+            start = self._START.search(self.raw)
+            if start is None:
+                return ""
+            self._pos = start.end()
+        out, raw, i = [], self.raw, self._pos
+        while i < len(raw):
+            char = raw[i]
+            if char == '"':
+                self._done = True
+                break
+            if char != "\\":
+                out.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(raw):
+                break
+            if raw[i + 1] != "u":
+                out.append(self._ESCAPES.get(raw[i + 1], raw[i + 1]))
+                i += 2
+                continue
+            # \uXXXX, or a surrogate pair of two of them
+            size = 12 if i + 6 <= len(raw) and 0xD800 <= int(raw[i + 2:i + 6], 16) < 0xDC00 else 6
+            if i + size > len(raw):
+                break
+            out.append(json.loads(f'"{raw[i:i + size]}"'))
+            i += size
+        self._pos = i
+        return "".join(out)
 
 class StartRequest(BaseModel):
     user_id: str
     problem_name: str
 
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, err: Overloaded):
+    """Answer requests admission control turned away with 429 and when to try again."""
+    return JSONResponse(status_code=429, content={"detail": str(err)},
+                        headers={"Retry-After": str(err.retry_after)})
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
@@ -218,123 +312,353 @@ async def root():
 async def health_check():
     return PlainTextResponse(status_code=200)
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text-format metrics for this worker."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def _intro_job(problem_name: str, problem_data):
+    """
+    (cache key, generate) for the problem's intro summary, or None if the template has no intro text.
+    The key covers everything the summary depends on, so a template edit invalidates it.
+    """
+    # Pull the stored conversation text
+    intro_text = "".join(problem_data.get("Understanding the Problem", {}).get("content", ""))
+    if not intro_text:
+        return None
+
+    messages = [
+        {"role": "system", "content": INTRO_PROMPT},
+        {"role": "user",   "content": intro_text},
+    ]
+
+    async def generate(fresh: bool = False):
+        # Only runs on a cache miss, so a cached intro never takes an admission slot
+        async with admission.slot(estimate_tokens(messages, 1500)):
+            return await complete(messages, temperature=0.5, max_tokens=1500, purpose="intro", coalesce=not fresh)
+    return content_hash(MODEL, INTRO_PROMPT, intro_text), generate
+
+async def _prewarm_intro_cache():
+    jobs = []
+    for name in registry.names():
+        job = _intro_job(name, registry.get(name))
+        if job is not None:
+            jobs.append((name, *job))
+    await intro_cache.prewarm(jobs)
+
 @app.post("/start")
-async def start_interview(payload: StartRequest):
+async def start_interview(payload: StartRequest, request: Request):
     """
     Initialize a new system design interview session for the given user and problem.
     Returns the initial prompt from the interviewer (assistant) and the starting stage.
     """
+    # A double-clicked Start joins the one already running instead of resetting the session twice;
+    # once it has finished, pressing Start again restarts the interview
+    key = call_key(endpoint="start", problem_name=payload.problem_name)
+    try:
+        return await cancel_on_disconnect(request, admission.turn(payload.user_id, key, lambda: _start(payload),
+                                                                  replay=False))
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client disconnected")
+
+async def _start(payload: StartRequest):
     # Reset or create a new session for this user
     user_id = payload.user_id
     problem_name = payload.problem_name
-    if user_id in sessions:
-        del sessions[user_id]
-    sessions[user_id] = SessionState(problem_name)
-    session = sessions[user_id]
-    stage_name = session.current_stage_name()
-    # If the problem JSON has an introductory description of the problem, include that in the first prompt
-    intro_prompt = (
-        "You are a helpful assistant that summarizes the following"
-        "conversation in a few sentences so we can make a good start of the interview."
-        "You need to summarize the problem in a way like you are a system design interviewer."
-    )
-    # Pull the stored conversation text
-    intro_text = session.problem_data.get("Understanding the Problem", {}).get("content", "")
-    intro_text = "".join(intro_text)
-
-    if intro_text:
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": intro_prompt},
-                {"role": "user",   "content": intro_text},
-            ],
-            temperature=0.5,
-            max_tokens=1500,
-        )
-        intro_text = completion.choices[0].message.content.strip()
-    # Construct the initial assistant message
-    if intro_text:
-        assistant_msg = (
-            f"**Problem:** {intro_text}\n\n"
-            f"Let's start with **Stage 1: {stage_name}**. "
-            f"To begin, could you summarize your understanding of the problem and its requirements?"
-        )
-    else:
-        assistant_msg = (
-            f"Starting the system design interview for **{problem_name}**. "
-            f"Let's begin with **Stage 1: {stage_name}**. "
-            "First, could you describe your understanding of the problem requirements and scope?"
-        )
-    # Save the assistant's message to history and return it
-    session.history = [{"role": "assistant", "content": assistant_msg}]
-    return {"reply": assistant_msg, "nextStage": stage_name}
+    # Pinned so the new session can't be evicted while its intro is being written
+    with sessions.pinned(user_id):
+        session = SessionState(problem_name, sessions.new_archive(user_id))
+        await sessions.create(user_id, session)
+        stage_name = session.current_stage_name()
+        # If the problem JSON has an introductory description of the problem, include its (cached) summary in the first prompt
+        intro_text = ""
+        job = _intro_job(problem_name, session.problem_data)
+        if job is not None:
+            try:
+                intro_text = await intro_cache.get(problem_name, *job)
+            except OpenAIError as err:
+                # Timed out or every model is down: the greeting without the intro still starts the interview
+                print("OpenAI error (intro summary):", err)
+                metrics.annotate(error=str(err))
+        # Construct the initial assistant message
+        if intro_text:
+            assistant_msg = (
+                f"**Problem:** {intro_text}\n\n"
+                f"Let's start with **Stage 1: {stage_name}**. "
+                f"To begin, could you summarize your understanding of the problem and its requirements?"
+            )
+        else:
+            assistant_msg = (
+                f"Starting the system design interview for **{problem_name}**. "
+                f"Let's begin with **Stage 1: {stage_name}**. "
+                "First, could you describe your understanding of the problem requirements and scope?"
+            )
+        # Save the assistant's message to history and return it
+        session.history = [{"role": "assistant", "content": clean_whitespace(assistant_msg)}]
+        await _save_session(user_id, session)
+        return {"reply": assistant_msg, "nextStage": stage_name}
 
-@app.post("/interact")
-def interact(user_input: UserInput):
+async def summarize_stage(stage_history: list) -> str:
+    """Summarize a finished stage's transcript; falls back to a condensed digest if the model call fails for any reason."""
+    # 1) Build a transcript of the stage history
+    transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in stage_history)
+    # 2) Ask the model to summarize that transcript
+    summary_messages = [
+        {
+            "role": "system",
+            "content": (
+                "You are a helpful assistant that "
+                "summarizes the following conversation in a few sentences "
+                "so the interview can continue seamlessly"
+            )
+        },
+        {"role": "user", "content": transcript}
+    ]
+    try:
+        async with admission.slot(estimate_tokens(summary_messages, 200)):
+            return await complete(summary_messages, temperature=0.3, max_tokens=200, purpose="summary")
+    except Exception as err:
+        print("Stage summary failed:", err)
+        return "\n".join(condense(m) for m in stage_history[-6:])
+
+async def _archive_summary(archive: ArchivedHistory, stage: int, stage_history: list) -> str:
+    """Summarize archived stage `stage` and store the summary with it, where every worker can read it."""
+    summary = await summarize_stage(stage_history)
+    try:
+        await archive.set_summary(stage, summary)
+    except Exception as err:
+        # This worker still uses it; others fall back to the condensed digest after waiting for it
+        print("Stage summary could not be stored:", err)
+    return summary
+
+async def _prepare_turn(user_input: UserInput):
     """
-    Process the candidate's message and generate the interviewer's response for the current stage.
-    Advances to the next stage when appropriate.
+    Resolve the session and build the user message (with any diagram attached) for one turn.
+    Returns (session, user_message, diagram); nothing is stored on the session until _finish_turn.
     """
     user_id = user_input.user_id
     user_message = user_input.message
-    graph_data = user_input.graph
-    
-    # Convert graph data to string and append to message
-    if graph_data:
-        graph_str = f"\n\nGraph Data:\n{json.dumps(graph_data, indent=2)}"
-        user_message += graph_str
     
     # Ensure there's an active session
-    if user_id not in sessions:
+    session = await sessions.load(user_id)
+    if session is None:
         raise HTTPException(status_code=400, detail="No active interview session for this user. Please start a session first.")
-    session = sessions[user_id]
-    # Assemble the prompt messages for the AI, and record the user's message in history
-    messages = assemble_messages(session, user_message)
-    session.history.append({"role": "user", "content": user_message})
-    # Call OpenAI API (or an agent) to get the interviewer AI's response
-    try:
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.5,
-            max_tokens=1500
-        )
-    except OpenAIError as err:
-        print("OpenAI error:", err)
-        raise HTTPException(status_code=500, detail=f"AI generation failed: {str(err)}")
-    ai_reply = completion.choices[0].message.content.strip()
-    # Save the assistant's response in the history
-    session.history.append({"role": "assistant", "content": ai_reply})
+    # The previous stage's summary must be in history before we build on it
+    await session.resolve_summary()
+    
+    # Append the diagram in compact form, or only what changed since the model last saw it
+    diagram = None
+    if user_input.elements:
+        diagram = session.normalize(user_input.elements)
+    elif user_input.graph:
+        diagram = canonicalize(user_input.graph)
+    if diagram is not None:
+        diagram_text, full = session.describe_diagram(diagram)
+        user_message += f"\n\n{diagram_text}"
+        diagram = (diagram, full)
+    # Cleaned once here; this exact text is sent and then stored in history
+    with metrics.span("clean_whitespace"):
+        user_message = clean_whitespace(user_message)
+    return session, user_message, diagram
+
+def _cache_scope(session: SessionState, diagram) -> Optional[str]:
+    """Response cache scope of this turn: same problem, stage, turn number and interviewer question; None if uncached."""
+    stage_name = session.current_stage_name()
+    if not RESPONSE_CACHE or diagram is not None or stage_name not in RESPONSE_CACHE_STAGES:
+        return None
+    question = session.history[-1]["content"] if session.history and session.history[-1]["role"] == "assistant" else ""
+    turn = sum(1 for m in session.history if m["role"] == "user")
+    return scope_key(MODEL, STRUCTURED_TURNS, session.problem_name, registry.version(session.problem_name),
+                     stage_name, turn, question)
+
+async def _finish_turn(session: SessionState, user_message: str, ai_reply: str, diagram=None,
+                       advance: Optional[bool] = None, summary: Optional[str] = None) -> str:
+    """
+    Record a completed turn, advance the stage if the interviewer asked to, and return the stage name.
+    A structured turn passes its explicit `advance` decision and the `summary` of the stage it ends;
+    otherwise the reply is scanned for a stage change and the summary is written by a separate call.
+    """
+    with metrics.span("history_append"):
+        if diagram is not None:
+            session.record_diagram(*diagram)
+        # Record the user's message and the assistant's response in the history
+        # user_message was cleaned in _prepare_turn; stored messages are never cleaned again
+        session.history.append({"role": "user", "content": user_message})
+        session.history.append({"role": "assistant", "content": clean_whitespace(ai_reply)})
     # Check if we should advance to the next stage based on the assistant's reply
     if not session.at_final_stage():
-        # If the AI explicitly says to move on to next stage (or mentions the next stage), then advance
-        if any(kw in ai_reply.lower() for kw in ("next stage", "move to stage", "move on to stage")):
-            # 1) Build a transcript of the current-stage history
-            transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in session.history)
-            # 2) Ask the model to summarize that transcript
-            summary_messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a helpful assistant that "
-                        "summarizes the following conversation in a few sentences "
-                        "so the interview can continue seamlessly"
-                    )
-                },
-                {"role": "user", "content": transcript}
-            ]
-            summary_resp = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=summary_messages,
-                temperature=0.3,
-                max_tokens=200
-            )
-            summary = summary_resp.choices[0].message.content.strip()
-            # 3) Advance the stage, archive the old history, and start with the summary
+        if advance is None:
+            # If the AI explicitly says to move on to next stage (or mentions the next stage), then advance
+            advance = any(kw in ai_reply.lower() for kw in ("next stage", "move to stage", "move on to stage"))
+        if advance:
+            # Advance the stage and archive the old history right away
+            archived = session.history
             session.advance_stage()
-            session.allHistory.append(session.history)
-            session.history = [
-                {"role": "assistant", "content": f"**Summary so far:** {summary}"}
-            ]
-    return {"reply": ai_reply, "nextStage": session.current_stage_name()}
+            await session.allHistory.append(archived)
+            stage = len(session.allHistory) - 1
+            if summary:
+                # The structured turn already carries the summary: no extra model call
+                await session.allHistory.set_summary(stage, summary)
+                session.history = [{"role": "assistant", "content": clean_whitespace(f"**Summary so far:** {summary}")}]
+            else:
+                # The summary that opens the new stage is written in the background and picked up by the next request
+                session.history = []
+                session.summary_stage = stage
+                session.pending_summary = asyncio.create_task(_archive_summary(session.allHistory, stage, archived))
+    return session.current_stage_name()
+
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/interact")
+async def interact(user_input: UserInput, request: Request):
+    """
+    Process the candidate's message and generate the interviewer's response for the current stage.
+    Advances to the next stage when appropriate.
+    """
+    # A resend of this exact request joins the turn already running instead of starting another
+    key = call_key(endpoint="interact", **user_input.model_dump(exclude={"user_id"}))
+    try:
+        return await cancel_on_disconnect(request, admission.turn(user_input.user_id, key, lambda: _interact(user_input)))
+    except ClientDisconnected:
+        # Nothing was recorded yet, so the candidate can simply resend the message
+        raise HTTPException(status_code=499, detail="Client disconnected")
+
+async def _interact(user_input: UserInput):
+    # Pinned so the session can't be evicted for space while the model is answering
+    with sessions.pinned(user_input.user_id):
+        session, user_message, diagram = await _prepare_turn(user_input)
+        stage_name = session.current_stage_name()
+        # A near-identical answer to the same opening question may already have a reply
+        scope = _cache_scope(session, diagram)
+        cached = response_cache.lookup(scope, user_input.message) if scope else None
+        advance = summary = None
+        if cached is not None:
+            ai_reply, advance = cached, False   # only replies that kept the stage are cached
+        else:
+            # Assemble the prompt messages for the AI
+            messages = assemble_messages(session, user_message, structured=STRUCTURED_TURNS,
+                                         diagram=diagram[0] if diagram else None)
+            response_format = {"type": "json_object"} if STRUCTURED_TURNS else None
+            # Call OpenAI API (or an agent) to get the interviewer AI's response, once admitted
+            try:
+                async with admission.slot(estimate_tokens(messages, 1500)):
+                    ai_reply = await complete(messages, temperature=0.5, max_tokens=1500, response_format=response_format)
+            except OpenAIError as err:
+                print("OpenAI error:", err)
+                metrics.annotate(error=str(err))
+                # Out of time or every model is down: tell the client it's upstream, not a bug here
+                status = 504 if isinstance(err, DeadlineExceeded) else 503 if isinstance(err, CircuitOpen) else 500
+                raise HTTPException(status_code=status, detail=f"AI generation failed: {str(err)}")
+            if STRUCTURED_TURNS:
+                turn = parse_turn(ai_reply)
+                if turn is not None:
+                    ai_reply, advance, summary = turn.reply.strip(), turn.advance_stage, turn.rolling_summary.strip()
+                else:
+                    # Not valid structured output: keep the raw text and fall back to scanning it
+                    metrics.STRUCTURED_FALLBACKS.inc()
+        next_stage = await _finish_turn(session, user_message, ai_reply, diagram, advance, summary)
+        if scope and cached is None and next_stage == stage_name:
+            response_cache.store(scope, user_input.message, ai_reply)
+        await _save_session(user_input.user_id, session)
+        return {"reply": ai_reply, "nextStage": next_stage}
+
+@app.post("/interact/stream")
+async def interact_stream(user_input: UserInput):
+    """
+    Streaming variant of /interact using Server-Sent Events.
+    Emits a `token` event per reply delta, then one `done` event with the full reply and nextStage
+    (or an `error` event if generation fails). With STRUCTURED_TURNS only the JSON's reply field is
+    streamed; the stage decision and summary are read from the whole object once it has arrived,
+    and `done` carries the reply as recorded (the raw text if the JSON didn't parse).
+    """
+    user_id = user_input.user_id
+    # Streams can't be shared with a resend, so a second request while one runs is simply refused. The
+    # turn is claimed before the session is loaded and, with the pin, held until the reply is recorded;
+    # from then on the response owns both (released here if we never get that far)
+    admission.claim_stream(user_id)
+    sessions.pin(user_id)
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            sessions.unpin(user_id)
+            admission.release_stream(user_id)
+
+    try:
+        session, user_message, diagram = await _prepare_turn(user_input)
+        stage_name = session.current_stage_name()
+        scope = _cache_scope(session, diagram)
+        cached = response_cache.lookup(scope, user_input.message) if scope else None
+        if cached is None:
+            messages = assemble_messages(session, user_message, structured=STRUCTURED_TURNS,
+                                         diagram=diagram[0] if diagram else None)
+            response_format = {"type": "json_object"} if STRUCTURED_TURNS else None
+            estimate = estimate_tokens(messages, 1500)
+            # Refuse with a plain 429 while that is still possible; the slot itself is taken once streaming starts
+            admission.check(estimate)
+    except BaseException:
+        release()
+        raise
+
+    async def turn_events():
+        parts = []
+        advance = summary = None
+        if cached is not None:
+            # A cached reply goes out as a single delta
+            parts.append(cached)
+            advance = False   # only replies that kept the stage are cached
+            yield _sse("token", {"text": cached})
+        else:
+            reply = ReplyStream() if STRUCTURED_TURNS else None
+            try:
+                async with admission.slot(estimate):
+                    async for token in stream(messages, temperature=0.5, max_tokens=1500,
+                                              response_format=response_format):
+                        parts.append(token)
+                        text = reply.feed(token) if reply is not None else token
+                        if text:
+                            yield _sse("token", {"text": text})
+            except OpenAIError as err:
+                print("OpenAI error:", err)
+                yield _sse("error", {"detail": f"AI generation failed: {str(err)}"})
+                return
+        # Starlette cancels this generator if the client disconnects, so we only get here with a full reply
+        ai_reply = "".join(parts).strip()
+        if cached is None and STRUCTURED_TURNS:
+            turn = parse_turn(ai_reply)
+            if turn is not None:
+                ai_reply, advance, summary = turn.reply.strip(), turn.advance_stage, turn.rolling_summary.strip()
+            else:
+                # Not valid structured output: keep the raw text and fall back to scanning it
+                metrics.STRUCTURED_FALLBACKS.inc()
+        next_stage = await _finish_turn(session, user_message, ai_reply, diagram, advance, summary)
+        if scope and cached is None and next_stage == stage_name:
+            response_cache.store(scope, user_input.message, ai_reply)
+        try:
+            await _save_session(user_id, session)
+        except HTTPException as err:
+            yield _sse("error", {"detail": err.detail})
+            return
+        yield _sse("done", {"reply": ai_reply, "nextStage": next_stage})
+
+    async def events():
+        # The user's turn lasts until the reply is recorded, not just until the last token
+        try:
+            async for event in turn_events():
+                yield event
+        except Overloaded as err:
+            yield _sse("error", {"detail": str(err), "retryAfter": err.retry_after})
+        finally:
+            release()
+
+    # The background task also runs when the client left before the body was started, which events() never sees
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release),
+    )
@@ -0,0 +1,160 @@
+"""
+context.py – Token-budgeted prompt assembly for the interviewer.
+
+Tokens are counted locally (tiktoken when installed, a character estimate
+otherwise).  Each request is kept under PROMPT_TOKEN_BUDGET: the most recent
+turns of the current stage are sent verbatim and older turns are folded, once
+each, into a short running digest that is carried on the session.
+"""
+
+import os, re
+from functools import lru_cache
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "16000"))
+# Share of the budget the stage reference material may take before it is trimmed
+REFERENCE_TOKEN_SHARE = float(os.getenv("REFERENCE_TOKEN_SHARE", "0.6"))
+# Most recent history messages that are always sent verbatim
+CONTEXT_KEEP_RECENT = int(os.getenv("CONTEXT_KEEP_RECENT", "6"))
+# Cap on how much of a single folded message survives in the digest
+DIGEST_LINE_TOKENS = 60
+# Fixed per-message overhead the chat format adds on top of the content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+try:
+    import tiktoken
+except ImportError:  # optional dependency
+    tiktoken = None
+
+_encoding = None
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _get_encoding():
+    global _encoding, tiktoken
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            # Encoding files could not be loaded (e.g. offline); fall back to the estimate
+            tiktoken = None
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in text for the gpt-4o family (approximate without tiktoken)."""
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(messages: list) -> int:
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+@lru_cache(maxsize=1024)
+def _static_tokens(text: str) -> int:
+    # System prompts are the same string objects every turn (see prompts.stage_prefix)
+    return count_tokens(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens, marking the cut."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    enc = _get_encoding()
+    if enc is not None:
+        return enc.decode(enc.encode(text, disallowed_special=())[:max_tokens]) + " …"
+    return text[:max_tokens * 4] + " …"
+
+
+def condense(message: dict) -> str:
+    """One digest line for a message: its opening sentences, capped at DIGEST_LINE_TOKENS."""
+    text = " ".join(message["content"].split())
+    lead = " ".join(_SENTENCE_END.split(text)[:2])
+    return f"{message['role']}: {truncate_to_tokens(lead, DIGEST_LINE_TOKENS)}"
+
+
+class ContextState:
+    """Per-session digest of history messages that no longer fit verbatim."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget the digest; called whenever the stage (and therefore history) changes."""
+        self.folded = 0     # number of leading history messages already folded into lines
+        self.lines = []     # one condensed line per folded message
+        self.costs = []     # [content length, tokens] per history message, counted once
+
+    def message_costs(self, history: list) -> list:
+        """Token cost of every history message. Only messages not seen before are counted."""
+        costs = self.costs
+        # History only grows at the end (or gets a summary put in front), so a length mismatch
+        # marks the first entry that has to be recounted
+        valid = 0
+        while valid < len(costs) and valid < len(history) and costs[valid][0] == len(history[valid]["content"]):
+            valid += 1
+        del costs[valid:]
+        for msg in history[valid:]:
+            costs.append([len(msg["content"]), count_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS])
+        return [tokens for _, tokens in costs]
+
+    def fold(self, history: list, upto: int):
+        """Fold history[self.folded:upto] into the digest. Each message is condensed only once."""
+        for msg in history[self.folded:upto]:
+            self.lines.append(condense(msg))
+        self.folded = max(self.folded, upto)
+
+    def digest(self, max_tokens: int) -> str:
+        """Digest text, dropping the oldest lines first if it exceeds max_tokens."""
+        kept, used = [], 0
+        for line in reversed(self.lines):
+            cost = count_tokens(line) + 1
+            if used + cost > max_tokens:
+                break
+            kept.append(line)
+            used += cost
+        return "\n".join(reversed(kept))
+
+
+def build_context(system_messages: list, history: list, user_message: dict, state: ContextState,
+                  budget: int = PROMPT_TOKEN_BUDGET, reference: int = None) -> list:
+    """
+    Fit system prompts, history and the new user message into `budget` tokens.
+    system_messages[reference], the reference material, is trimmed first if the fixed part alone
+    is too large (no other system message is ever cut); then history is kept newest-first and
+    the rest folded.
+    """
+    system_messages = list(system_messages)
+    fixed = sum(_static_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in system_messages)
+    fixed += count_message_tokens([user_message])
+    if fixed > budget and reference is not None:
+        # Trim the reference block down to its share of the budget (or whatever is left)
+        ref = system_messages[reference]
+        others = fixed - count_message_tokens([ref])
+        allowed = max(int(budget * REFERENCE_TOKEN_SHARE), budget - others) - MESSAGE_OVERHEAD_TOKENS
+        system_messages[reference] = {**ref, "content": truncate_to_tokens(ref["content"], allowed)}
+        fixed = count_message_tokens(system_messages) + count_message_tokens([user_message])
+
+    remaining = budget - fixed
+    costs = state.message_costs(history)
+    # Walk history from the newest message, keeping verbatim while it fits
+    start = len(history)
+    for i in range(len(history) - 1, state.folded - 1, -1):
+        cost = costs[i]
+        if cost > remaining and len(history) - i > CONTEXT_KEEP_RECENT:
+            break
+        remaining -= cost
+        start = i
+
+    state.fold(history, start)
+    messages = system_messages
+    if state.lines:
+        digest = state.digest(max(remaining - MESSAGE_OVERHEAD_TOKENS, 0))
+        if digest:
+            messages.append({"role": "system", "content": f"**Earlier in this stage (condensed):**\n{digest}"})
+    messages.extend(history[start:])
+    messages.append(user_message)
+    return messages
@@ -0,0 +1,179 @@
+"""
+diagram.py – Compact, canonical encoding of the candidate's diagram.
+
+The frontend sends either the raw Excalidraw elements (`normalize_elements`)
+or the older graph built by `processData` (`canonicalize`).  For the model only
+the labels and how things connect matter, so both are reduced to components,
+arrows, direct nesting and free-text notes, and each turn sends just the delta
+against the diagram the model last saw.
+"""
+
+import hashlib, heapq, json
+
+# Element types that are connectors rather than components
+CONNECTOR_TYPES = ("arrow", "line", "freedraw")
+
+
+def _direct_nesting(pairs: set) -> set:
+    """Keep only (parent, child) pairs with nothing nested in between (transitive reduction)."""
+    outers = {}
+    for outer, inner in pairs:
+        outers.setdefault(inner, set()).add(outer)
+    direct = set()
+    for inner, candidates in outers.items():
+        for outer in candidates:
+            # `outer` is indirect if some other container of `inner` is itself inside `outer`
+            if not any(mid != outer and outer in outers.get(mid, ()) for mid in candidates):
+                direct.add((outer, inner))
+    return direct
+
+
+def _finish(nodes: dict, edges: set, contains: set, notes: list) -> dict:
+    edges = {(s, d) for s, d in edges if s in nodes and d in nodes and s != d}
+    return {
+        "nodes": dict(sorted(nodes.items(), key=lambda kv: (kv[1], kv[0]))),
+        "edges": sorted([s, d] for s, d in edges),
+        "contains": sorted([o, i] for o, i in _direct_nesting(contains)),
+        "notes": sorted(notes),
+    }
+
+
+def canonicalize(graph: dict) -> dict:
+    """Reduce a processData graph to {"nodes": {id: label}, "edges", "contains", "notes"} (JSON-safe, sorted)."""
+    nodes, notes, edges = {}, [], set()
+    for eid, el in graph.items():
+        if not isinstance(el, dict):
+            continue
+        kind = el.get("type")
+        label = " ".join(str(el.get("val") or "").split())
+        if kind == "FreeText":
+            if label:
+                notes.append(label)
+        elif kind == "arrow":
+            if el.get("start") and el.get("end"):
+                edges.add((el["start"], el["end"]))
+        elif kind not in CONNECTOR_TYPES:
+            nodes[eid] = label or f"unlabeled {kind}"
+    # processData puts both arrow targets and nested shapes in `ngr`; anything not explained by an arrow is nesting
+    contains = {
+        (eid, inner)
+        for eid, el in graph.items()
+        if eid in nodes and isinstance(el, dict)
+        for inner in el.get("ngr", [])
+        if inner in nodes and (eid, inner) not in edges
+    }
+    return _finish(nodes, edges, contains, notes)
+
+
+def containment_pairs(boxes: dict) -> set:
+    """
+    All (outer, inner) pairs where box inner lies fully inside box outer; boxes are id -> (x, y, w, h).
+    Sweep over x: a box can only contain boxes that start at or after its left edge and before its
+    right edge, so each box is only compared with the boxes still "open" when it starts.
+    """
+    # Wider boxes first on equal x so a container is open before the boxes it holds
+    order = sorted(boxes, key=lambda b: (boxes[b][0], -boxes[b][2], -boxes[b][3], b))
+    open_boxes, expiry = {}, []     # id -> box; heap of (right edge, id)
+    pairs = set()
+    for bid in order:
+        x, y, w, h = boxes[bid]
+        while expiry and expiry[0][0] < x:
+            open_boxes.pop(heapq.heappop(expiry)[1], None)
+        for oid, (ox, oy, ow, oh) in open_boxes.items():
+            # Identical boxes are siblings, not nested, so the result never has cycles
+            if ox + ow >= x + w and oy <= y and oy + oh >= y + h and (ox, oy, ow, oh) != (x, y, w, h):
+                pairs.add((oid, bid))
+        open_boxes[bid] = (x, y, w, h)
+        heapq.heappush(expiry, (x + w, bid))
+    return pairs
+
+
+def normalize_elements(elements: list) -> dict:
+    """
+    Canonical diagram straight from raw Excalidraw elements: bound text labels its container,
+    arrows bound at both ends become edges, and shape nesting is resolved by containment_pairs.
+    """
+    live = [el for el in elements if isinstance(el, dict) and not el.get("isDeleted")]
+    shapes = {el["id"]: el for el in live if el.get("type") not in CONNECTOR_TYPES + ("text",)}
+    nodes = {sid: "" for sid in shapes}
+    notes, edges = [], set()
+    for el in live:
+        kind = el.get("type")
+        if kind == "text":
+            text = " ".join(str(el.get("text") or "").split())
+            if el.get("containerId") in nodes:
+                nodes[el["containerId"]] = text
+            elif text and not el.get("containerId"):     # arrow labels are dropped
+                notes.append(text)
+        elif kind == "arrow":
+            start, end = el.get("startBinding") or {}, el.get("endBinding") or {}
+            if start.get("elementId") and end.get("elementId"):
+                edges.add((start["elementId"], end["elementId"]))
+    for sid, label in nodes.items():
+        nodes[sid] = label or f"unlabeled {shapes[sid].get('type')}"
+    boxes = {
+        sid: (float(el.get("x", 0)), float(el.get("y", 0)), float(el.get("width", 0)), float(el.get("height", 0)))
+        for sid, el in shapes.items()
+    }
+    return _finish(nodes, edges, containment_pairs(boxes), notes)
+
+
+def elements_key(elements: list) -> str:
+    """Cheap fingerprint of an element list; Excalidraw bumps `version` on every edit."""
+    if all("version" in el for el in elements if isinstance(el, dict)):
+        parts = [(el.get("id"), el.get("version"), bool(el.get("isDeleted"))) for el in elements if isinstance(el, dict)]
+    else:
+        parts = elements
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _edge_lines(pairs, nodes: dict, arrow: str) -> list:
+    return sorted(f"{nodes[a]} {arrow} {nodes[b]}" for a, b in pairs)
+
+
+def _by_label(ids, nodes: dict) -> list:
+    # Sets of ids iterate in hash order, which differs between processes; sorting keeps the prompt reproducible
+    return sorted(ids, key=lambda nid: (nodes[nid], nid))
+
+
+def encode(diagram: dict) -> str:
+    """Full text form of a canonical diagram."""
+    nodes = diagram["nodes"]
+    if not nodes and not diagram["notes"]:
+        return "Diagram: (empty)"
+    lines = ["Diagram:"]
+    if nodes:
+        lines.append("Components: " + "; ".join(nodes.values()))
+    if diagram["edges"]:
+        lines.append("Connections: " + "; ".join(_edge_lines(diagram["edges"], nodes, "->")))
+    if diagram["contains"]:
+        lines.append("Nesting: " + "; ".join(_edge_lines(diagram["contains"], nodes, "contains")))
+    if diagram["notes"]:
+        lines.append("Notes: " + "; ".join(diagram["notes"]))
+    return "\n".join(lines)
+
+
+def diff(old: dict, new: dict) -> str:
+    """Text describing what changed from old to new; ids keep renamed components stable."""
+    lines = []
+    old_nodes, new_nodes = old["nodes"], new["nodes"]
+    for nid in _by_label(new_nodes.keys() - old_nodes.keys(), new_nodes):
+        lines.append(f"+ component {new_nodes[nid]}")
+    for nid in _by_label(old_nodes.keys() - new_nodes.keys(), old_nodes):
+        lines.append(f"- component {old_nodes[nid]}")
+    for nid in _by_label(new_nodes.keys() & old_nodes.keys(), old_nodes):
+        if new_nodes[nid] != old_nodes[nid]:
+            lines.append(f"~ renamed {old_nodes[nid]} -> {new_nodes[nid]}")
+    both = {**old_nodes, **new_nodes}
+    for key, arrow in (("edges", "->"), ("contains", "contains")):
+        before = {tuple(p) for p in old[key]}
+        after = {tuple(p) for p in new[key]}
+        lines += ["+ " + line for line in _edge_lines(after - before, both, arrow)]
+        lines += ["- " + line for line in _edge_lines(before - after, both, arrow)]
+    for note in sorted(set(new["notes"]) - set(old["notes"])):
+        lines.append(f"+ note {note}")
+    for note in sorted(set(old["notes"]) - set(new["notes"])):
+        lines.append(f"- note {note}")
+    if not lines:
+        return "Diagram: unchanged since the previous message."
+    return "Diagram changes since the previous message:\n" + "\n".join(lines)
@@ -0,0 +1,160 @@
+"""
+diagram_scoring.py – Check the candidate's diagram against the reference figures.
+
+The scraper stores every reference figure of a template as a {"nodes", "edges"}
+graph.  For each (problem, stage) the architecture figures (those with edges)
+are merged into one reference made of their component titles; bullet lines,
+arrow captions, method names and entity fields are dropped.  Edges scraped
+from the SVGs are too loose to compare, so only components are checked.
+Labels are normalised (case, punctuation, plurals, a synonym table) and matched
+by token overlap through an inverted index, so scoring a diagram takes well
+under a millisecond.  `coverage` returns a few lines for the prompt: which
+reference components the candidate has drawn and which are missing.
+"""
+
+import os, re
+from functools import lru_cache
+from template_registry import registry
+
+# Feed the reference coverage summary into the interviewer prompt (1/0)
+DIAGRAM_SCORING = os.getenv("DIAGRAM_SCORING", "1") == "1"
+# Two labels match when this share of their tokens agree (Jaccard)
+MATCH_THRESHOLD = 0.5
+# Names listed per line of the summary
+MAX_LISTED = 6
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STEP = re.compile(r"\d+[).]")
+_SYMBOLS = re.compile(r"[()/:?{}]|^(GET|POST|PUT|PATCH|DELETE)\b")
+# Words that say nothing about which component a label is
+GENERIC = frozenset({"service", "server", "svc", "the", "a", "an", "of", "and", "for", "with", "layer", "system"})
+# Common names and products -> one canonical phrase
+SYNONYMS = {
+    "db": "database", "rdbms": "database", "sql": "database", "nosql": "database", "datastore": "database",
+    "postgres": "database", "postgresql": "database", "mysql": "database", "dynamodb": "database",
+    "cassandra": "database", "mongodb": "database", "mongo": "database", "store": "database",
+    "redis": "cache", "memcached": "cache", "memcache": "cache",
+    "lb": "load balancer", "elb": "load balancer", "alb": "load balancer", "nginx": "load balancer",
+    "apigw": "api gateway", "gateway": "api gateway",
+    "kafka": "queue", "sqs": "queue", "rabbitmq": "queue", "kinesis": "queue", "pubsub": "queue",
+    "broker": "queue", "stream": "queue",
+    "s3": "object storage", "blob": "object storage", "bucket": "object storage", "gcs": "object storage",
+    "elasticsearch": "search index", "opensearch": "search index", "solr": "search index",
+    "ws": "websocket", "websockets": "websocket", "socket": "websocket",
+    "cdn": "cdn", "cloudfront": "cdn", "akamai": "cdn",
+    "app": "client", "frontend": "client", "browser": "client", "mobile": "client", "ios": "client",
+    "android": "client", "user": "client", "users": "client",
+    "apns": "notification", "fcm": "notification", "push": "notification", "notifications": "notification",
+    "zookeeper": "coordinator", "etcd": "coordinator",
+}
+
+
+def normalize(label: str) -> frozenset:
+    """Canonical token set of a label: lowercase words, synonyms applied, plurals and filler dropped."""
+    tokens = []
+    for word in _WORD.findall(label.lower()):
+        word = SYNONYMS.get(word, word)
+        for part in word.split():
+            if len(part) > 3 and part.endswith("s") and not part.endswith("ss"):
+                part = part[:-1]
+            tokens.append(part)
+    core = frozenset(t for t in tokens if t not in GENERIC)
+    return core or frozenset(tokens)
+
+
+def is_component(label: str) -> bool:
+    """Whether a figure label is a component title rather than a bullet, method, field or annotation."""
+    label = label.strip()
+    if not label or len(label) > 40 or not re.search(r"[A-Za-z]{2}", label):
+        return False
+    # Titles are capitalised; captions and fields are not, and routes, steps and calls carry punctuation
+    return (label[0].isupper() or label[0].isdigit()) and not _STEP.match(label) and not _SYMBOLS.search(label)
+
+
+def similarity(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _figures(node):
+    """Every figure in a template section, depth first."""
+    if isinstance(node, dict):
+        yield from node.get("figures", []) or []
+        for key, child in node.items():
+            if key != "figures":
+                yield from _figures(child)
+    elif isinstance(node, list):
+        for child in node:
+            yield from _figures(child)
+
+
+class Reference:
+    """Merged reference architecture for one stage: component labels and a token index over them."""
+    def __init__(self, figures: list):
+        self.labels = []      # component display labels
+        self.tokens = []      # normalised token set per component
+        seen = set()
+        for fig in figures:
+            graph = fig.get("src") if isinstance(fig, dict) else None
+            if not isinstance(graph, dict) or not graph.get("edges"):
+                continue     # requirement lists and unparsed images carry no architecture
+            for node in graph.get("nodes", []):
+                # "API Gateway &" / "Load Balancer" arrive as two lines of one box
+                label = " ".join(str(node.get("label", "")).split()).rstrip(" &")
+                tokens = normalize(label)
+                if is_component(label) and tokens not in seen:
+                    seen.add(tokens)
+                    self.labels.append(label)
+                    self.tokens.append(tokens)
+        self.index = {}
+        for i, tokens in enumerate(self.tokens):
+            for token in tokens:
+                self.index.setdefault(token, []).append(i)
+
+    def match(self, label: str):
+        """Index of the reference component a candidate label names, or None."""
+        tokens = normalize(label)
+        candidates = {i for token in tokens for i in self.index.get(token, ())}
+        best = max(candidates, key=lambda i: (similarity(tokens, self.tokens[i]), -i), default=None)
+        if best is None or similarity(tokens, self.tokens[best]) < MATCH_THRESHOLD:
+            return None
+        return best
+
+
+@lru_cache(maxsize=256)
+def _reference(problem_name: str, stage_name: str, version: int) -> Reference:
+    return Reference(list(_figures(registry.get(problem_name).get(stage_name, {}))))
+
+
+def get_reference(problem_name: str, stage_name: str) -> Reference:
+    """The reference for (problem, stage), rebuilt when the template changes on disk."""
+    return _reference(problem_name, stage_name, registry.version(problem_name))
+
+
+def _listing(names) -> str:
+    names = sorted(names)
+    more = f" (+{len(names) - MAX_LISTED} more)" if len(names) > MAX_LISTED else ""
+    return ", ".join(names[:MAX_LISTED]) + more
+
+
+def coverage(problem_name: str, stage_name: str, diagram: dict) -> str:
+    """A few lines comparing a canonical diagram (diagram.py) with the stage's reference; "" if there is none."""
+    ref = get_reference(problem_name, stage_name)
+    if not ref.labels:
+        return ""
+    matched, extra = set(), []
+    for label in diagram["nodes"].values():
+        i = ref.match(label)
+        if i is not None:
+            matched.add(i)
+        elif not label.startswith("unlabeled"):
+            extra.append(label)
+    lines = [f"{len(matched)}/{len(ref.labels)} reference components present"
+             + (f": {_listing(ref.labels[i] for i in matched)}" if matched else "")]
+    missing = [ref.labels[i] for i in range(len(ref.labels)) if i not in matched]
+    if missing:
+        lines.append(f"Not in the diagram: {_listing(missing)}")
+    if extra:
+        lines.append(f"Candidate components with no reference counterpart: {_listing(extra)}")
+    return "\n".join(lines)
@@ -0,0 +1,134 @@
+"""
+intro_cache.py – Persistent cache of the /start problem-intro summaries.
+
+The intro summary depends only on the template's "Understanding the Problem"
+text and the prompt, so it is generated once per problem and stored on disk,
+keyed by a hash of that input; editing the template changes the hash and the
+entry is regenerated.  Up to INTRO_CACHE_VARIANTS summaries can be kept per
+problem and are handed out round-robin so candidates don't all see identical
+wording.  Several workers can share the file: each save re-reads it under a
+lock file and merges in what the others stored before replacing it, in a
+worker thread so waiting for another worker's lock never stalls the event loop.
+"""
+
+import asyncio, hashlib, itertools, json, os, threading, uuid
+from singleflight import SingleFlight
+try:
+    import fcntl
+except ImportError:     # Windows: saves from one process are still atomic, just not merged across processes
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INTRO_CACHE_PATH = os.getenv("INTRO_CACHE_PATH") or os.path.join(BASE_DIR, ".cache", "intro_summaries.json")
+INTRO_CACHE_VARIANTS = max(1, int(os.getenv("INTRO_CACHE_VARIANTS", "1")))
+# How many intro summaries to generate at once while prewarming
+PREWARM_CONCURRENCY = 4
+
+
+def content_hash(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class IntroCache:
+    """problem_name -> {"hash": ..., "variants": [...]}, persisted as JSON."""
+    def __init__(self, path: str = INTRO_CACHE_PATH, variants: int = INTRO_CACHE_VARIANTS):
+        self.path = path
+        self.variants = variants
+        self._entries = self._load()
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _merge(self, disk: dict, changed: str):
+        """Fold entries another worker saved into ours; for `changed` ours is the newer one."""
+        for problem_name, theirs in disk.items():
+            ours = self._entries.get(problem_name)
+            if ours is None or (ours["hash"] != theirs["hash"] and problem_name != changed):
+                self._entries[problem_name] = theirs
+            elif ours["hash"] == theirs["hash"]:
+                variants = theirs["variants"] + [v for v in ours["variants"] if v not in theirs["variants"]]
+                ours["variants"] = variants[-self.variants:]
+
+    def _save(self, changed: str):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)   # released when the file is closed
+            self._merge(self._load(), changed)
+            tmp = f"{self.path}.{os.getpid()}-{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._entries, f, ensure_ascii=False, indent=2)
+                os.replace(tmp, self.path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    def lookup(self, problem_name: str, key: str):
+        """A cached summary for this exact input (rotating across variants), or None."""
+        entry = self._entries.get(problem_name)
+        if not entry or entry["hash"] != key or len(entry["variants"]) < self.variants:
+            return None
+        counter = self._counters.setdefault(problem_name, itertools.count())
+        return entry["variants"][next(counter) % len(entry["variants"])]
+
+    def _store(self, problem_name: str, key: str, summary: str):
+        with self._lock:
+            entry = self._entries.get(problem_name)
+            if not entry or entry["hash"] != key:
+                # New problem or the template changed: drop every stale variant
+                entry = self._entries[problem_name] = {"hash": key, "variants": []}
+            if summary in entry["variants"]:
+                return    # a coalesced call handed back a summary we already have
+            entry["variants"] = (entry["variants"] + [summary])[-self.variants:]
+            try:
+                self._save(problem_name)
+            except OSError as err:
+                # The summary is still served from memory; it is written with the next save that works
+                print(f"Intro cache save failed for {problem_name}:", err)
+
+    async def store(self, problem_name: str, key: str, summary: str):
+        """Add a summary for key and save the file; the lock and the file I/O run in a worker thread."""
+        await asyncio.to_thread(self._store, problem_name, key, summary)
+
+    async def get(self, problem_name: str, key: str, generate) -> str:
+        """Return a cached summary for key, calling `await generate()` to fill the cache on a miss."""
+        summary = self.lookup(problem_name, key)
+        if summary is None:
+            # Every /start that misses meanwhile waits on this one generation (and its one admission slot)
+            summary, _ = await self._flights.do(f"{problem_name}\0{key}", generate)
+            await self.store(problem_name, key, summary)
+        return summary
+
+    async def prewarm(self, jobs: list):
+        """
+        Fill the cache for every (problem_name, key, generate) in jobs; failures are logged and skipped.
+        generate is called with fresh=True, since each extra variant needs its own sample.
+        """
+        semaphore = asyncio.Semaphore(PREWARM_CONCURRENCY)
+
+        async def warm(problem_name, key, generate):
+            async with semaphore:
+                # Keep generating until this problem has all its variants
+                while self.lookup(problem_name, key) is None:
+                    try:
+                        await self.store(problem_name, key, await generate(fresh=True))
+                    except Exception as err:
+                        print(f"Intro prewarm failed for {problem_name}:", err)
+                        return
+
+        await asyncio.gather(*(warm(*job) for job in jobs))
+
+
+intro_cache = IntroCache()
@@ -0,0 +1,293 @@
+"""
+llm.py – Async chat-completion access for the interview server.
+
+All model calls go through `complete`, which awaits the configured backend
+under a process-wide concurrency limit so slow completions never block the
+event loop, with deadlines, retries, hedging and failover from resilience.py.
+`stream` yields reply tokens as they arrive for the SSE endpoint, and
+`cancel_on_disconnect` abandons a call once the HTTP client that asked for it
+has gone away.  Identical concurrent `complete` calls (same model, parameters
+and messages) share one upstream request through a SingleFlight.
+
+LLM_BACKEND selects the backend: "openai" (default) or "stub", a deterministic
+local stand-in with configurable latency, token rate and scripted stage changes
+used for load tests and benchmarks.
+"""
+
+import asyncio, hashlib, json, os, random
+from openai import AsyncOpenAI, OpenAIError
+import metrics, resilience
+from context import count_message_tokens
+from singleflight import SingleFlight, call_key
+
+MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Backstop for one HTTP request; resilience.py times attempts out at the same share of the deadline
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT") or resilience.ATTEMPT_TIMEOUT)
+DISCONNECT_POLL_INTERVAL = 0.25
+# Share identical in-flight completions (1/0), and keep serving a finished one for this many seconds
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") == "1"
+LLM_COALESCE_GRACE = float(os.getenv("LLM_COALESCE_GRACE", "2"))
+
+# Stub backend knobs
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "400"))       # median time to first token
+LLM_STUB_LATENCY_SIGMA = float(os.getenv("LLM_STUB_LATENCY_SIGMA", "0.5"))  # log-normal spread
+LLM_STUB_TOKENS_PER_SEC = float(os.getenv("LLM_STUB_TOKENS_PER_SEC", "80"))
+LLM_STUB_REPLY_TOKENS = int(os.getenv("LLM_STUB_REPLY_TOKENS", "120"))
+LLM_STUB_ADVANCE_EVERY = int(os.getenv("LLM_STUB_ADVANCE_EVERY", "3"))     # candidate turns per stage
+# Stub fault injection: share of calls that fail with a transient error / hang, and models that always fail
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))
+LLM_STUB_HANG_RATE = float(os.getenv("LLM_STUB_HANG_RATE", "0"))
+LLM_STUB_HANG_SECONDS = float(os.getenv("LLM_STUB_HANG_SECONDS", "30"))
+LLM_STUB_FAILING_MODELS = [m for m in os.getenv("LLM_STUB_FAILING_MODELS", "").split(",") if m]
+
+_backend = None
+_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+_flights = SingleFlight(grace=LLM_COALESCE_GRACE)
+
+
+class ClientDisconnected(Exception):
+    """The caller hung up before the completion finished."""
+
+
+class InjectedFault(OpenAIError):
+    """Transient upstream failure raised by the stub backend's fault injection."""
+    retryable = True
+
+
+class OpenAIBackend:
+    """Chat completions from the OpenAI API (reads OPENAI_API_KEY from the env)."""
+    def __init__(self, timeout: float = LLM_TIMEOUT):
+        # Retries belong to resilience.py, where the breaker and the deadline can see them
+        self.client = AsyncOpenAI(timeout=timeout, max_retries=0)
+
+    async def complete(self, messages: list, *, model: str, temperature: float, max_tokens: int, usage: dict,
+                       response_format: dict = None) -> str:
+        extra = {"response_format": response_format} if response_format else {}
+        completion = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **extra,
+        )
+        if completion.usage is not None:
+            usage["prompt_tokens"] = completion.usage.prompt_tokens
+            usage["completion_tokens"] = completion.usage.completion_tokens
+        return completion.choices[0].message.content
+
+    async def stream(self, messages: list, *, model: str, temperature: float, max_tokens: int, usage: dict,
+                     response_format: dict = None):
+        extra = {"response_format": response_format} if response_format else {}
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            **extra,
+        )
+        try:
+            async for chunk in response:
+                if chunk.usage is not None:
+                    usage["prompt_tokens"] = chunk.usage.prompt_tokens
+                    usage["completion_tokens"] = chunk.usage.completion_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
+
+
+class StubBackend:
+    """
+    Deterministic local stand-in for the model. The same messages always give the same reply
+    and timings; latency is log-normal around `latency_ms`, tokens are emitted at `tokens_per_sec`,
+    and an interview turn asks for the next stage once the candidate has spoken `advance_every` times.
+    With a JSON response_format the same reply comes wrapped as a structured turn.
+    Faults are drawn independently of the reply: `error_rate` of calls fail, `hang_rate` of calls
+    stall for `hang_seconds`, and calls to any model in `failing_models` always fail.
+    """
+    WORDS = ("scale", "cache", "shard", "replica", "queue", "latency", "index", "partition",
+             "consistency", "throughput", "service", "database", "client", "request", "trade-off")
+
+    def __init__(self, latency_ms: float = LLM_STUB_LATENCY_MS, latency_sigma: float = LLM_STUB_LATENCY_SIGMA,
+                 tokens_per_sec: float = LLM_STUB_TOKENS_PER_SEC, reply_tokens: int = LLM_STUB_REPLY_TOKENS,
+                 advance_every: int = LLM_STUB_ADVANCE_EVERY, error_rate: float = LLM_STUB_ERROR_RATE,
+                 hang_rate: float = LLM_STUB_HANG_RATE, hang_seconds: float = LLM_STUB_HANG_SECONDS,
+                 failing_models=LLM_STUB_FAILING_MODELS):
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.failing_models = set(failing_models)
+        self._faults = random.Random()
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.advance_every = advance_every
+
+    def _script(self, messages: list, max_tokens: int):
+        """(first-token delay in seconds, reply tokens) for these messages."""
+        seed = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).digest()
+        rng = random.Random(seed)
+        delay = self.latency_ms / 1000 * rng.lognormvariate(0, self.latency_sigma)
+        count = max(1, min(max_tokens, int(self.reply_tokens * rng.uniform(0.5, 1.5))))
+        tokens = [rng.choice(self.WORDS) + " " for _ in range(count)]
+        # Candidate turns in the current stage: user messages after the last system message
+        last_system = max((i for i, m in enumerate(messages) if m["role"] == "system"), default=-1)
+        turns = sum(1 for m in messages[last_system + 1:] if m["role"] == "user")
+        if self.advance_every and turns >= self.advance_every and len(messages) > 2:
+            tokens.append("Great work, let's move to the next stage.")
+        return delay, tokens
+
+    async def _inject_faults(self, model: str):
+        if model in self.failing_models:
+            raise InjectedFault(f"stub: model {model} is failing")
+        roll = self._faults.random()
+        if roll < self.error_rate:
+            raise InjectedFault("stub: injected upstream error")
+        if roll < self.error_rate + self.hang_rate:
+            await asyncio.sleep(self.hang_seconds)
+
+    async def complete(self, messages: list, *, model: str, temperature: float, max_tokens: int, usage: dict,
+                       response_format: dict = None) -> str:
+        await self._inject_faults(model)
+        delay, tokens = self._script(messages, max_tokens)
+        await asyncio.sleep(delay + len(tokens) / self.tokens_per_sec)
+        usage.update(prompt_tokens=count_message_tokens(messages), completion_tokens=len(tokens))
+        reply = "".join(tokens)
+        if response_format and response_format.get("type") == "json_object":
+            return self._structured(messages, reply)
+        return reply
+
+    @staticmethod
+    def _structured(messages: list, reply: str) -> str:
+        advance = reply.endswith("next stage.")
+        return json.dumps({
+            "reply": reply,
+            "advance_stage": advance,
+            "rolling_summary": f"The candidate has sent {sum(m['role'] == 'user' for m in messages)} messages."
+                               if advance else "",
+        })
+
+    async def stream(self, messages: list, *, model: str, temperature: float, max_tokens: int, usage: dict,
+                     response_format: dict = None):
+        await self._inject_faults(model)
+        delay, tokens = self._script(messages, max_tokens)
+        usage.update(prompt_tokens=count_message_tokens(messages), completion_tokens=len(tokens))
+        if response_format and response_format.get("type") == "json_object":
+            # Same pacing, but the deltas are slices of the JSON object, cut anywhere (mid-escape included)
+            text = self._structured(messages, "".join(tokens))
+            size = -(-len(text) // len(tokens))
+            tokens = [text[i:i + size] for i in range(0, len(text), size)]
+        await asyncio.sleep(delay)
+        for token in tokens:
+            await asyncio.sleep(1 / self.tokens_per_sec)
+            yield token
+
+
+BACKENDS = {"openai": OpenAIBackend, "stub": StubBackend}
+
+
+def get_backend():
+    """Create the configured backend on first use."""
+    global _backend
+    if _backend is None:
+        if LLM_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown LLM_BACKEND {LLM_BACKEND!r}; expected one of {sorted(BACKENDS)}")
+        _backend = BACKENDS[LLM_BACKEND]()
+    return _backend
+
+
+def set_backend(backend):
+    """Swap the backend at runtime (benchmarks and tests)."""
+    global _backend
+    _backend = backend
+
+
+async def complete(messages: list, *, temperature: float = 0.5, max_tokens: int = 1500, model: str = MODEL,
+                   purpose: str = "interview", coalesce: bool = LLM_COALESCE, response_format: dict = None) -> str:
+    """
+    Run one chat completion and return the stripped reply text. `purpose` labels its metrics.
+    With coalesce, a call identical to one in flight (or just finished) shares its result; pass
+    coalesce=False when a distinct sample is wanted for the same prompt. response_format is passed
+    to the backend as-is (e.g. {"type": "json_object"}).
+    """
+    def call():
+        return _complete(messages, temperature=temperature, max_tokens=max_tokens, model=model, purpose=purpose,
+                         response_format=response_format)
+    if not coalesce:
+        return await call()
+    key = call_key(model=model, temperature=temperature, max_tokens=max_tokens, messages=messages,
+                   response_format=response_format)
+    reply, shared = await _flights.do(key, call)
+    if shared:
+        metrics.LLM_COALESCED.inc(purpose=purpose)
+        metrics.annotate(coalesced=True)
+    return reply
+
+
+async def _complete(messages: list, *, temperature: float, max_tokens: int, model: str, purpose: str,
+                    response_format: dict = None) -> str:
+    extra = {"response_format": response_format} if response_format else {}
+
+    async def attempt(target: str) -> str:
+        # One upstream request; resilience.call may make several (retries, hedges, fallback model)
+        usage = {}
+        async with _semaphore:
+            try:
+                reply = await get_backend().complete(messages, model=target, temperature=temperature,
+                                                     max_tokens=max_tokens, usage=usage, **extra)
+            except Exception:
+                metrics.LLM_ERRORS.inc(purpose=purpose)
+                raise
+        metrics.record_tokens(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), purpose)
+        return reply
+
+    with metrics.span(f"llm.{purpose}"):
+        reply = await resilience.call(attempt, model=model, purpose=purpose)
+    return reply.strip()
+
+
+async def stream(messages: list, *, temperature: float = 0.5, max_tokens: int = 1500, model: str = MODEL,
+                 purpose: str = "interview", response_format: dict = None):
+    """
+    Run one chat completion, yielding reply text deltas as they arrive. `purpose` labels its metrics.
+    With a JSON response_format the deltas are raw slices of the JSON object, not of the reply.
+    """
+    extra = {"response_format": response_format} if response_format else {}
+
+    async def open_stream(target: str):
+        usage = {}
+        async with _semaphore:
+            try:
+                async for token in get_backend().stream(messages, model=target, temperature=temperature,
+                                                        max_tokens=max_tokens, usage=usage, **extra):
+                    yield token
+            except Exception:
+                metrics.LLM_ERRORS.inc(purpose=purpose)
+                raise
+            finally:
+                metrics.record_tokens(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), purpose)
+
+    with metrics.span(f"llm.{purpose}"):
+        async for token in resilience.stream(open_stream, model=model, purpose=purpose):
+            yield token
+
+
+async def cancel_on_disconnect(request, coro):
+    """Await coro, cancelling it and raising ClientDisconnected if the client disconnects first."""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
@@ -0,0 +1,251 @@
+"""
+loadtest.py – Offline load test / latency benchmark for app2.
+
+Drives many concurrent simulated candidates through all four STAGES on every
+template and reports p50/p95/p99 latency per endpoint, throughput, event-loop
+lag and memory per session.  By default the app runs in-process against the
+local stub LLM (LLM_BACKEND=stub), so no network or API key is needed.
+In-process, httpx buffers streamed responses, so time-to-first-token is only
+meaningful with --url against a real server.
+
+Usage:
+    python loadtest.py --users 200 --concurrency 50
+    python loadtest.py --users 50 --stream --json report.json
+    python loadtest.py --users 50 --error-rate 0.1 --hang-rate 0.02   # fault injection
+    python loadtest.py --url http://localhost:8000 --users 20   # an already running server
+"""
+
+import argparse, asyncio, json, os, random, sys, tempfile, time, tracemalloc
+
+# Configure the app for an offline run before it is imported
+os.environ.setdefault("LLM_BACKEND", "stub")
+os.environ.setdefault("INTRO_CACHE_PREWARM", "0")
+os.environ.setdefault("INTRO_CACHE_PATH", os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "intro.json"))
+
+import httpx
+
+# Turns a candidate spends in the final stage, which never advances on its own
+FINAL_STAGE_TURNS = 3
+# Safety cap so a misbehaving backend can't keep a candidate going forever
+MAX_TURNS = 40
+LAG_PROBE_INTERVAL = 0.01
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "max_ms": round(max(values, default=0) * 1000, 1),
+    }
+
+
+def synthetic_graph(rng: random.Random, size: int) -> dict:
+    """A processData-shaped diagram with `size` labelled boxes and a chain of arrows."""
+    graph = {}
+    for i in range(size):
+        graph[f"n{i}"] = {"type": "rectangle", "val": f"Service {i}", "ngr": [],
+                          "position": {"x": rng.randint(0, 2000), "y": rng.randint(0, 2000), "width": 120, "height": 60}}
+    for i in range(1, size):
+        graph[f"a{i}"] = {"type": "arrow", "val": "", "ngr": [], "start": f"n{i - 1}", "end": f"n{i}",
+                          "position": {"x": 0, "y": 0, "width": 0, "height": 0}}
+        graph[f"n{i - 1}"]["ngr"].append(f"n{i}")
+    return graph
+
+
+async def read_stream(resp, start: float) -> dict:
+    """Consume an SSE response; return the `done` payload (time to first token since `start` under `ttft`)."""
+    ttft, result = None, {}
+    buffer = ""
+    async for chunk in resp.aiter_text():
+        buffer += chunk
+        while "\n\n" in buffer:
+            frame, buffer = buffer.split("\n\n", 1)
+            lines = dict(line.split(": ", 1) for line in frame.splitlines() if ": " in line)
+            if lines.get("event") == "token" and ttft is None:
+                ttft = time.perf_counter() - start
+            elif lines.get("event") == "done":
+                result = json.loads(lines["data"])
+            elif lines.get("event") == "error":
+                raise RuntimeError(json.loads(lines["data"])["detail"])
+    result["ttft"] = ttft
+    return result
+
+
+async def post(client, path: str, payload: dict, stats: dict):
+    """POST, waiting out 429s for their Retry-After like a well-behaved client."""
+    while True:
+        resp = await client.post(path, json=payload)
+        if resp.status_code != 429:
+            return resp
+        stats["rejected"] += 1
+        await asyncio.sleep(float(resp.headers.get("Retry-After", "1")))
+
+
+async def candidate(client, user_id: str, problem: str, stages: list, args, stats: dict, rng: random.Random):
+    """One simulated candidate: /start, then /interact until the last stage has had a few turns."""
+    t = time.perf_counter()
+    resp = await post(client, "/start", {"user_id": user_id, "problem_name": problem}, stats)
+    stats["start"].append(time.perf_counter() - t)
+    resp.raise_for_status()
+    stage, final_turns, diagram_size = resp.json()["nextStage"], 0, 2
+    for turn in range(MAX_TURNS):
+        message = f"For {stage} I would {rng.choice(['add a cache', 'shard by id', 'use a queue', 'replicate reads'])}."
+        payload = {"user_id": user_id, "message": message}
+        if stages.index(stage) >= 2:
+            # Diagrams grow during the design stages
+            diagram_size += rng.randint(0, 3)
+            payload["graph"] = synthetic_graph(rng, diagram_size)
+        t = time.perf_counter()
+        if args.stream:
+            while True:
+                async with client.stream("POST", "/interact/stream", json=payload) as resp:
+                    if resp.status_code != 429:
+                        resp.raise_for_status()
+                        result = await read_stream(resp, t)
+                        break
+                stats["rejected"] += 1
+                await asyncio.sleep(float(resp.headers.get("Retry-After", "1")))
+            if result["ttft"] is not None:
+                stats["ttft"].append(result["ttft"])
+        else:
+            resp = await post(client, "/interact", payload, stats)
+            resp.raise_for_status()
+            result = resp.json()
+        stats["interact"].append(time.perf_counter() - t)
+        stats["turns"] += 1
+        stage = result["nextStage"]
+        if stage == stages[-1]:
+            final_turns += 1
+            if final_turns > FINAL_STAGE_TURNS:
+                break
+
+
+async def lag_probe(samples: list, stop: asyncio.Event):
+    """Measure how late a short sleep wakes up: a direct read of event-loop blocking."""
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(LAG_PROBE_INTERVAL)
+        samples.append(max(0.0, time.perf_counter() - t - LAG_PROBE_INTERVAL))
+
+
+async def run(args) -> dict:
+    from prompts import STAGES
+    from template_registry import registry
+    problems = args.problems or registry.names()
+
+    app = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=None)
+    else:
+        import app2
+        app = app2
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app2.app), base_url="http://loadtest", timeout=None)
+
+    stats = {"start": [], "interact": [], "ttft": [], "turns": 0, "errors": 0, "rejected": 0}
+    lag, stop = [], asyncio.Event()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rng = random.Random(args.seed)
+
+    async def one(i):
+        async with semaphore:
+            try:
+                await candidate(client, f"loadtest-{i}", problems[i % len(problems)], STAGES, args, stats,
+                                random.Random(rng.random()))
+            except Exception as err:
+                stats["errors"] += 1
+                print(f"candidate {i} failed: {err!r}", file=sys.stderr)
+
+    if app is not None:
+        tracemalloc.start()
+        lifespan = app.app.router.lifespan_context(app.app)
+        await lifespan.__aenter__()
+        mem_before = tracemalloc.get_traced_memory()[0]
+    probe = asyncio.create_task(lag_probe(lag, stop))
+    started = time.perf_counter()
+    async with client:
+        await asyncio.gather(*(one(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+
+    report = {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "stream": args.stream,
+        "problems": len(problems),
+        "elapsed_s": round(elapsed, 2),
+        "requests": len(stats["start"]) + len(stats["interact"]),
+        "throughput_rps": round((len(stats["start"]) + len(stats["interact"])) / elapsed, 1),
+        "turns": stats["turns"],
+        "errors": stats["errors"],
+        "rejected": stats["rejected"],
+        "start": summarize(stats["start"]),
+        "interact": summarize(stats["interact"]),
+        "event_loop_lag": summarize(lag),
+    }
+    if stats["ttft"]:
+        report["time_to_first_token"] = summarize(stats["ttft"])
+    if app is not None:
+        mem_after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        await app.sessions.sweep()   # a shared store only counts its sessions when it sweeps
+        live = len(app.sessions)
+        report["sessions_live"] = live
+        report["history_bytes"] = app.sessions.total_bytes
+        report["memory_per_session_kb"] = round((mem_after - mem_before) / max(live, 1) / 1024, 1)
+        await lifespan.__aexit__(None, None, None)
+    return report
+
+
+def print_report(report: dict):
+    print(f"{report['users']} candidates x {report['problems']} problems, concurrency {report['concurrency']}"
+          f"{' (streaming)' if report['stream'] else ''}")
+    print(f"  {report['requests']} requests / {report['turns']} turns in {report['elapsed_s']}s "
+          f"= {report['throughput_rps']} req/s, {report['errors']} errors, {report['rejected']} answered 429")
+    for key in ("start", "interact", "time_to_first_token", "event_loop_lag"):
+        if key in report:
+            s = report[key]
+            print(f"  {key:<20} p50 {s['p50_ms']:>8}ms  p95 {s['p95_ms']:>8}ms  p99 {s['p99_ms']:>8}ms  max {s['max_ms']:>8}ms")
+    if "memory_per_session_kb" in report:
+        print(f"  sessions live {report['sessions_live']}, history {report['history_bytes']} bytes, "
+              f"~{report['memory_per_session_kb']} KiB traced memory per session")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=100, help="simulated candidates in total")
+    parser.add_argument("--concurrency", type=int, default=25, help="candidates active at once")
+    parser.add_argument("--problems", nargs="*", help="templates to use (default: all)")
+    parser.add_argument("--stream", action="store_true", help="use /interact/stream instead of /interact")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--error-rate", type=float, help="stub: share of LLM calls that fail transiently")
+    parser.add_argument("--hang-rate", type=float, help="stub: share of LLM calls that stall")
+    args = parser.parse_args(argv)
+    # The app is imported in run(), so stub fault settings still apply
+    if args.error_rate is not None:
+        os.environ["LLM_STUB_ERROR_RATE"] = str(args.error_rate)
+    if args.hang_rate is not None:
+        os.environ["LLM_STUB_HANG_RATE"] = str(args.hang_rate)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
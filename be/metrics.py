@@ -0,0 +1,193 @@
+"""
+metrics.py – In-process counters, histograms and timing spans.
+
+Everything is exported in the Prometheus text format by `render()` (served at
+/metrics).  `span("phase")` times a block into the phase histogram and, while a
+request is being served, into that request's record, which RequestMetricsMiddleware
+logs as one JSON line per request when REQUEST_LOG=1.
+"""
+
+import contextvars, json, logging, os, threading, time
+from contextlib import contextmanager
+
+REQUEST_LOG = os.getenv("REQUEST_LOG", "0") == "1"
+PREFIX = "design_agent_"
+# Seconds; covers everything from a cache hit to a slow completion
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+logger = logging.getLogger("design_agent.requests")
+if REQUEST_LOG and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+_request = contextvars.ContextVar("request_metrics", default=None)
+_lock = threading.Lock()
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help = PREFIX + name, help
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(dict(k))} {v}" for k, v in sorted(self.values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = TIME_BUCKETS):
+        self.name, self.help, self.buckets = PREFIX + name, help, buckets
+        self.values = {}   # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            state = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, state in sorted(self.values.items()):
+            labels = dict(key)
+            for bound, count in zip(self.buckets, state):
+                lines.append(f"{self.name}_bucket{_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{self.name}_bucket{_labels({**labels, 'le': '+Inf'})} {state[-1]}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {state[-2]}")
+            lines.append(f"{self.name}_count{_labels(labels)} {state[-1]}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+    def __init__(self, name: str, help: str, fn):
+        self.name, self.help, self.fn = PREFIX + name, help, fn
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.fn()}"]
+
+
+_registry = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# ------------------------------------------------------------------ standard metrics
+REQUESTS = register(Counter("http_requests_total", "HTTP requests by route template and status."))
+REQUEST_SECONDS = register(Histogram("http_request_seconds", "HTTP request duration by route template."))
+# Path label of requests that matched no route (404s, scanners)
+UNMATCHED_ROUTE = "other"
+PHASE_SECONDS = register(Histogram("phase_seconds", "Time spent in each phase of /start and /interact."))
+LLM_TOKENS = register(Counter("llm_tokens_total", "LLM tokens by kind (prompt/completion) and purpose."))
+LLM_ERRORS = register(Counter("llm_errors_total", "Failed LLM calls by purpose."))
+STRUCTURED_FALLBACKS = register(Counter("structured_turn_fallbacks_total", "Structured turns that failed validation and were read as plain text."))
+LLM_COALESCED = register(Counter("llm_coalesced_total", "LLM calls served by an identical call already in flight."))
+PROMPT_CHARS = register(Histogram("prompt_chars", "Characters in each assembled interviewer prompt.", SIZE_BUCKETS))
+PROMPT_TOKENS = register(Histogram("prompt_tokens", "Locally counted tokens in each assembled interviewer prompt.", SIZE_BUCKETS))
+
+
+def current() -> dict:
+    """The record of the request being served, or None outside a request."""
+    return _request.get()
+
+
+@contextmanager
+def span(phase: str):
+    """Time the enclosed block as `phase`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PHASE_SECONDS.observe(elapsed, phase=phase)
+        record = _request.get()
+        if record is not None:
+            record["phases"][phase] = round(record["phases"].get(phase, 0) + elapsed * 1000, 2)
+
+
+def record_tokens(prompt: int, completion: int, purpose: str = "interview"):
+    LLM_TOKENS.inc(prompt, kind="prompt", purpose=purpose)
+    LLM_TOKENS.inc(completion, kind="completion", purpose=purpose)
+    record = _request.get()
+    if record is not None:
+        record["prompt_tokens"] = record.get("prompt_tokens", 0) + prompt
+        record["completion_tokens"] = record.get("completion_tokens", 0) + completion
+
+
+def annotate(**fields):
+    """Attach extra fields to the current request's log record."""
+    record = _request.get()
+    if record is not None:
+        record.update(fields)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware: per-route request count/latency, plus an optional JSON log line per request.
+    Timing ends when the last body chunk is sent, so streamed responses are measured in full.
+    Metrics are labelled with the matched route's template ("/items/{id}"), and requests that match
+    no route share the "other" label, so arbitrary URLs can't create new series."""
+    def __init__(self, app, exclude=("/metrics",)):
+        self.app = app
+        self.exclude = exclude
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            return await self.app(scope, receive, send)
+        record = {"method": scope["method"], "path": scope["path"], "phases": {}}
+        token = _request.set(record)
+        start = time.perf_counter()
+        status = {"code": 500, "done": False}
+
+        def finish():
+            if status["done"]:
+                return
+            status["done"] = True
+            elapsed = time.perf_counter() - start
+            # The router has stored the matched route in the scope by the time a response is sent
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+            REQUESTS.inc(path=route, status=status["code"])
+            REQUEST_SECONDS.observe(elapsed, path=route)
+            if REQUEST_LOG:
+                record.update(status=status["code"], duration_ms=round(elapsed * 1000, 2))
+                logger.info(json.dumps(record, default=str))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+            _request.reset(token)
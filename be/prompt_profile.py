@@ -0,0 +1,177 @@
+"""
+prompt_profile.py – Offline prompt-size profiler for every template and stage.
+
+For each (problem, stage) it reports, in locally counted tokens:
+  * the static prefix (global, stage and problem system messages) as configured,
+  * the problem_data[stage] block, both as stringified JSON and as rendered
+    into the prompt, and whether the rendering is cut to its budget share,
+  * the prompt assemble_messages builds on each of N simulated turns, with the
+    per-turn growth and whether any turn reaches PROMPT_TOKEN_BUDGET.
+
+Turns go through the app's own _prepare_turn / assemble_messages / _finish_turn,
+so diagrams are delta-encoded, history is folded and retrieval or diagram
+scoring apply exactly as the environment configures them.  Turns are synthetic
+(seeded messages, stub-style replies, diagrams that grow during the design
+stages like loadtest.py's) unless --transcript gives recorded ones.  Nothing
+is sent to a model.  The JSON report has no timings, so it can be diffed in CI.
+
+Usage:
+    python prompt_profile.py
+    python prompt_profile.py --turns 20 --json prompt_profile.json
+    python prompt_profile.py --problems uber bitly --transcript recorded.json
+    python prompt_profile.py --fail-over-budget    # exit 1 if any prompt reaches the budget
+
+A transcript is a JSON list of turns: {"message": ..., "graph" or "elements": ..., "reply": ...}.
+"""
+
+import argparse, asyncio, json, os, random, sys, tempfile
+
+# Configure the app for an offline run before it is imported
+os.environ.setdefault("LLM_BACKEND", "stub")
+os.environ.setdefault("INTRO_CACHE_PREWARM", "0")
+os.environ.setdefault("INTRO_CACHE_PATH", os.path.join(tempfile.mkdtemp(prefix="prompt-profile-"), "intro.json"))
+os.environ["SESSION_BACKEND"] = "memory"
+
+import app2
+from context import PROMPT_TOKEN_BUDGET, REFERENCE_TOKEN_SHARE, count_message_tokens, count_tokens, _get_encoding
+from llm import StubBackend, LLM_STUB_REPLY_TOKENS
+from loadtest import synthetic_graph
+from prompts import STAGES, render_section, stage_prefix
+from retrieval import RETRIEVAL_TOP_K
+from template_registry import registry
+
+SENTENCES = (
+    "I would put a load balancer in front of stateless application servers.",
+    "Reads dominate, so a cache in front of the database should absorb most of the traffic.",
+    "We can shard the data by user id to spread writes evenly.",
+    "Writes go through a queue so spikes don't overload the database.",
+    "The core entities are users, the main resource and an audit log of changes.",
+    "Consistency matters more than availability for this part of the system.",
+    "We need low latency for the read path, ideally under two hundred milliseconds.",
+    "Replicas in each region would keep reads local and survive a zone outage.",
+)
+# Synthetic candidate messages are this many sentences long
+MESSAGE_SENTENCES = 3
+# Diagram boxes at the first design-stage turn; a few are added per turn after that
+DIAGRAM_START_SIZE = 2
+
+
+def synthetic_turns(stage: str, turns: int, rng: random.Random) -> list:
+    """Candidate messages, stub-style replies and (in the design stages) growing diagrams."""
+    result, size = [], DIAGRAM_START_SIZE
+    for _ in range(turns):
+        turn = {
+            "message": " ".join(rng.choice(SENTENCES) for _ in range(MESSAGE_SENTENCES)),
+            "reply": " ".join(rng.choice(StubBackend.WORDS) for _ in range(LLM_STUB_REPLY_TOKENS)) + "?",
+        }
+        if STAGES.index(stage) >= 2:
+            turn["graph"] = synthetic_graph(rng, size)
+            size += rng.randint(0, 3)
+        result.append(turn)
+    return result
+
+
+async def profile_stage(problem: str, stage: str, turns: list) -> list:
+    """Prompt tokens on each turn of a fresh session sitting in `stage`."""
+    user_id = f"prompt-profile:{problem}:{stage}"
+    session = app2.SessionState(problem, app2.sessions.new_archive(user_id))
+    session.stage_index = STAGES.index(stage)
+    session.history = [{"role": "assistant", "content": f"Let's continue with **{stage}**."}]
+    app2.sessions[user_id] = session
+    sizes = []
+    try:
+        for turn in turns:
+            user_input = app2.UserInput(user_id=user_id, message=turn["message"],
+                                        graph=turn.get("graph"), elements=turn.get("elements"))
+            session, user_message, diagram = await app2._prepare_turn(user_input)
+            messages = app2.assemble_messages(session, user_message, structured=app2.STRUCTURED_TURNS,
+                                              diagram=diagram[0] if diagram else None)
+            sizes.append(count_message_tokens(messages))
+            # advance=False: the simulated interviewer never moves the stage on
+            await app2._finish_turn(session, user_message, turn["reply"], diagram, advance=False)
+    finally:
+        del app2.sessions[user_id]
+    return sizes
+
+
+async def run(args) -> dict:
+    problems = args.problems or registry.names()
+    recorded = None
+    if args.transcript:
+        with open(args.transcript, "r", encoding="utf-8") as f:
+            recorded = json.load(f)[:args.turns]
+    reference_cap = int(PROMPT_TOKEN_BUDGET * REFERENCE_TOKEN_SHARE)
+    report = {
+        "config": {
+            "tokenizer": "tiktoken o200k_base" if _get_encoding() is not None else "estimate (4 chars/token)",
+            "prompt_token_budget": PROMPT_TOKEN_BUDGET,
+            "reference_token_cap": reference_cap,
+            "retrieval_top_k": RETRIEVAL_TOP_K,
+            "structured_turns": app2.STRUCTURED_TURNS,
+            "turns": len(recorded) if recorded is not None else args.turns,
+            "transcript": os.path.basename(args.transcript) if args.transcript else "synthetic",
+            "seed": args.seed,
+        },
+        "templates": {},
+    }
+    for problem in problems:
+        problem_data = registry.get(problem)
+        stages = {}
+        for stage in STAGES:
+            section = problem_data.get(stage, {})
+            rendered = count_tokens(render_section(section))
+            rng = random.Random(f"{args.seed}:{problem}:{stage}")
+            sizes = await profile_stage(problem, stage, recorded if recorded is not None else
+                                        synthetic_turns(stage, args.turns, rng))
+            stages[stage] = {
+                "static_prefix_tokens": count_message_tokens(
+                    stage_prefix(problem, stage, full_reference=not RETRIEVAL_TOP_K, structured=app2.STRUCTURED_TURNS)),
+                "stage_json_tokens": count_tokens(json.dumps(section, ensure_ascii=False)),
+                "stage_rendered_tokens": rendered,
+                "stage_truncated": rendered > reference_cap,
+                "turn_prompt_tokens": sizes,
+                "growth_per_turn": round((sizes[-1] - sizes[0]) / (len(sizes) - 1), 1) if len(sizes) > 1 else 0,
+                "max_prompt_tokens": max(sizes, default=0),
+                "over_budget": max(sizes, default=0) >= PROMPT_TOKEN_BUDGET,
+            }
+        report["templates"][problem] = stages
+    return report
+
+
+def print_report(report: dict):
+    config = report["config"]
+    print(f"{config['turns']} {config['transcript']} turns per stage, budget {config['prompt_token_budget']} tokens "
+          f"({config['tokenizer']}, retrieval top-k {config['retrieval_top_k']})")
+    print(f"  {'problem':<22} {'stage':<26} {'prefix':>7} {'json':>7} {'render':>7} {'turn 1':>7} "
+          f"{'last':>7} {'+/turn':>7}")
+    for problem, stages in report["templates"].items():
+        for stage, row in stages.items():
+            sizes = row["turn_prompt_tokens"] or [0]
+            flags = (" cut" if row["stage_truncated"] else "") + (" OVER BUDGET" if row["over_budget"] else "")
+            print(f"  {problem:<22} {stage:<26} {row['static_prefix_tokens']:>7} {row['stage_json_tokens']:>7} "
+                  f"{row['stage_rendered_tokens']:>7} {sizes[0]:>7} {sizes[-1]:>7} {row['growth_per_turn']:>7}{flags}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--problems", nargs="*", help="templates to profile (default: all)")
+    parser.add_argument("--turns", type=int, default=10, help="simulated turns per stage")
+    parser.add_argument("--transcript", help="JSON list of recorded turns to replay instead of synthetic ones")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--fail-over-budget", action="store_true", help="exit 1 if any prompt reaches the budget")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if args.fail_over_budget and any(row["over_budget"] for stages in report["templates"].values()
+                                     for row in stages.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
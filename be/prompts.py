@@ -0,0 +1,241 @@
+"""
+prompts.py – Interview stages, interviewer prompts and the static prompt prefix.
+
+The system messages that open every interviewer request depend only on
+(problem, stage), so they are rendered once into compact, deterministic text
+and memoised.  Keeping them byte-identical and first in the message list lets
+the provider's prompt-prefix cache hit across turns and across users.
+
+The provider only caches prompts of PROMPT_CACHE_MIN_TOKENS or more, counted
+from the start.  With retrieval on, the per-turn chunks come after the prefix
+and can't be part of the cached span, so the prefix itself must reach that
+size: it carries the problem's requirements and the stage outline with its
+solution tiers, topped up from the opening of the stage's example answer when
+that is still not enough.
+"""
+
+import os
+from functools import lru_cache
+from context import PROMPT_TOKEN_BUDGET, REFERENCE_TOKEN_SHARE, count_message_tokens, truncate_to_tokens
+from template_registry import registry
+
+# Smallest prompt the provider's prefix cache will store (1024 tokens for OpenAI)
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+# Aim this far above the minimum: the local count may only be an estimate of the provider's tokenizer
+PROMPT_CACHE_HEADROOM = 64
+# Cap on the problem requirements repeated in every later stage's prefix when retrieval is on
+PROBLEM_BRIEF_TOKENS = 600
+
+# Standardized interview stages (in order)
+STAGES = ["Understanding the Problem", "The Set Up", "High-Level Design", "Potential Deep Dives"]
+
+STAGE_PROMPTS = {
+    "Understanding the Problem": """
+**Stage 1 - Understanding the Problem**
+Goals
+• List and clarify **functional requirements** ("what the system must do").
+• List and clarify **non-functional requirements** (latency, throughput, scale, SLA, consistency, availability, cost, security…).
+• Surface ambiguities & assumptions; decide what is explicitly *out of scope*.
+• Quantify key NFRs with ballpark numbers if possible (QPS, p99 latency, data size, traffic growth).
+
+Interviewer checklist
+1. Ask the candidate to restate the problem in their own words.
+2. Elicit functional requirements with open questions ("What should users be able to do?"). Probe edge-cases.
+3. Switch to NFRs: latency, scale, consistency, availability, durability, cost.
+4. Push for concrete numbers (or reasonable estimates) that drive design decisions.
+5. Confirm scope & assumptions; summarise and get explicit agreement before moving on.
+""",
+
+    "The Set Up": """
+**Stage 2 - The Set Up**
+Goals
+• Identify core **entities / data objects** and their high-level attributes.
+• Define the main **APIs / operations** needed to satisfy functional requirements.
+• Mark system boundaries & external dependencies (auth, payments, 3rd-party services).
+• Optionally outline a rough step-by-step plan for tackling the design.
+
+Interviewer checklist
+1. Prompt for key nouns → entities. Capture concise definitions.
+2. Prompt for key verbs → API endpoints or RPCs. Cover CRUD & special ops.
+3. Ask which responsibilities are handled inside vs outside (e.g. authentication, email, push notifications).
+4. Ensure every functional requirement from Stage 1 maps to at least one API.
+5. Summarise entities & APIs; confirm completeness with the candidate before proceeding.
+""",
+
+    "High-Level Design": """
+**Stage 3 - High-Level Design**
+Goals
+• Sketch the architecture: major components/services, data stores, caches, queues.
+• Describe data-flow for key operations end-to-end.
+• Select technologies/types (SQL vs NoSQL, message broker, CDN, etc.) and justify briefly.
+• Show how the design meets the stated functional & primary non-functional requirements.
+• Highlight major trade-offs and alternatives.
+
+Interviewer checklist
+1. Ask candidate to enumerate components; probe each for responsibility.
+2. Walk through a core user request - which component does what?
+3. Check that the design provides stated latency/throughput/availability targets (point to cache, replicas, etc.).
+4. Introduce missing standard pieces via questions (load-balancer, cache, etc.).
+5. Summarise the architecture; ensure all requirements are addressed before deep dives.
+""",
+
+    "Potential Deep Dives": """
+**Stage 4 - Potential Deep Dives**
+Goals
+• Investigate 1-2 challenging areas in detail (scaling reads/writes, sharding, consistency model, fault-tolerance, security, etc.).
+• Discuss algorithms, data-partitioning strategy, replication & failover, index design, caching strategy, quotas, back-pressure, etc.
+• Analyse failure modes, trade-offs, and capacity limits.
+• Demonstrate depth of understanding and practical decision-making.
+
+Interviewer checklist
+1. Pick the most critical bottleneck or risk; ask the candidate to propose solutions.
+2. Push on edge-cases, race-conditions, failure scenarios. Ask for mitigation.
+3. Compare multiple approaches (e.g. consistent hashing vs range partitioning).
+4. If time permits, tackle a second deep-dive area (security, cost optimisation, migrations…).
+5. Wrap up by summarising the improved design and remaining open questions.
+""",
+}
+
+INTERVIEWER_BEHAVIOR_PROMPT = """
+You are a **professional System-Design Interviewer AI**.  You simulate a real FAANG/
+tier-1 interviewer in a mock interview.  You **always** run the conversation in
+**four sequential stages** and **never skip ahead**:
+
+1. **Understanding the Problem** - Clarify every functional & non-functional
+   requirement; push for concrete numbers; confirm in/out-of-scope.
+2. **The Set Up** - Identify core entities and main APIs; define system boundaries;
+   establish the shared vocabulary for the design.
+3. **High-Level Design** - Lay out the architecture: components, data-flow,
+   technology choices, trade-offs, how the design satisfies the requirements.
+4. **Potential Deep Dives** - Pick 1-2 challenging areas (scalability,
+   consistency, fault-tolerance, security, etc.) and explore them in depth,
+   analysing algorithms, data-partitioning, failure modes, trade-offs.
+
+**Behaviour rules**
+• Plan silently first: recall the stage goals, think, then reply.
+• Stay strictly on the **current stage**; gently refuse to answer out-of-stage
+  questions ("Let's finish X before we tackle Y").
+• Guide with **questions & hints**, not full answers.  Encourage the candidate
+  to reason aloud; nudge if they are stuck.
+• If the candidate omits a critical point, ask an open question to surface it.
+• Before advancing a stage, **summarise** what has been achieved and explicitly
+  confirm agreement with the candidate.
+• If you want to proceed to the next stage, say "next stage" or "move on to stage". Specifically when you are done with the current stage and form now on you will be asking questions to the candidate from the next stage.
+• Maintain a friendly, supportive tone.  Your goal is to help the candidate
+  think deeply, demonstrate structured reasoning, and cover trade-offs.
+"""
+# Summarizes the template's problem description into the opening message of /start
+INTRO_PROMPT = (
+    "You are a helpful assistant that summarizes the following"
+    "conversation in a few sentences so we can make a good start of the interview."
+    "You need to summarize the problem in a way like you are a system design interviewer."
+)
+
+REFERENCE_SUFFIX = (
+    "The above answer contains more data than the user can handle, so you need to ask "
+    "follow up questions to the candidate to understand the problem better."
+)
+
+# Output contract for STRUCTURED_TURNS: one completion carries the reply, the stage decision and, when the
+# stage ends, the summary that opens the next one (so no separate summary call is needed)
+STRUCTURED_TURN_PROMPT = (
+    "**Response format:** answer with a single JSON object and nothing else, keys in this order:\n"
+    '{"reply": "<your message to the candidate, markdown allowed>", '
+    '"advance_stage": <true|false>, '
+    '"rolling_summary": "<only when advance_stage is true: at most 120 words on what the candidate has '
+    'covered and decided so far in the whole interview; otherwise an empty string>"}\n'
+    "Set advance_stage to true only when this reply closes the current stage and your next questions belong "
+    "to the next stage; do not rely on the words \"next stage\" in the reply for that."
+)  # reply comes first so /interact/stream can show it while the rest is still being written
+
+
+# ------------------------------------------------------------------ rendering
+def _render(node, level: int, lines: list):
+    """Append a nested template section as markdown: paragraphs, figures, then titled children."""
+    if isinstance(node, str):
+        lines.append(node)
+        return
+    if isinstance(node, list):
+        for item in node:
+            _render(item, level, lines)
+        return
+    for item in node.get("content", []):
+        lines.append(item)
+    for fig in node.get("figures", []):
+        labels = ", ".join(n["label"] for n in fig.get("src", {}).get("nodes", []))
+        lines.append(f"[Figure: {fig.get('caption', '')}] {labels}".rstrip())
+    for title, child in node.get("subsections", {}).items():
+        lines.append(f"{'#' * level} {title}")
+        _render(child, level + 1, lines)
+    # Solution variants ("Good Solution: …") and H6 blocks sit beside "content" as extra keys
+    for title, child in node.items():
+        if title not in ("content", "figures", "subsections"):
+            lines.append(f"{'#' * level} {title}")
+            _render(child, level + 1, lines)
+
+
+def render_section(section, level: int = 3) -> str:
+    """Compact markdown rendering of one template section (e.g. problem_data[stage]); titles start at `level`."""
+    lines = []
+    _render(section, level, lines)
+    return "\n".join(lines)
+
+
+def render_outline(section) -> str:
+    """The subsection titles of a template section, each followed by its solution tiers (Bad/Good/Great ...)."""
+    lines = []
+    for title, child in section.get("subsections", {}).items():
+        lines.append(f"- {title}")
+        if isinstance(child, dict):
+            lines.extend(f"  - {key}" for key in child if key not in ("content", "figures", "subsections"))
+    return "\n".join(lines)
+
+
+# Position of the "Example answer" message in a full-reference stage prefix (after the global and stage prompts)
+REFERENCE_INDEX = 2
+
+
+@lru_cache(maxsize=256)
+def _stage_prefix(problem_name: str, stage_name: str, version: int, full_reference: bool, structured: bool) -> tuple:
+    problem_data = registry.get(problem_name)
+    # 1. Global interviewer behavior system prompt
+    prefix = [{"role": "system", "content": INTERVIEWER_BEHAVIOR_PROMPT}]
+    # 2. Stage-specific instructions as another system prompt
+    if stage_name in STAGE_PROMPTS:
+        prefix.append({"role": "system", "content": f"**Stage: {stage_name}** - {STAGE_PROMPTS[stage_name]}"})
+    else:
+        prefix.append({"role": "system", "content": f"Stage: {stage_name}"})
+    # 3. Problem-specific content for the current stage, capped so the budget never has to trim it per turn.
+    #    With retrieval on, the stage material here is its outline and the relevant parts are added per turn.
+    section = problem_data.get(stage_name, {})
+    if full_reference:
+        reference = render_section(section)
+        reference = truncate_to_tokens(reference, int(PROMPT_TOKEN_BUDGET * REFERENCE_TOKEN_SHARE))
+        prefix.append({"role": "system", "content": f"**Example answer:**\n{reference}\n\n{REFERENCE_SUFFIX}"})
+    else:
+        if stage_name != STAGES[0]:
+            brief = truncate_to_tokens(render_section(problem_data.get(STAGES[0], {})), PROBLEM_BRIEF_TOKENS)
+            if brief:
+                prefix.append({"role": "system", "content": f"**Problem requirements (from the example answer):**\n{brief}"})
+        if section.get("subsections"):
+            prefix.append({"role": "system", "content": f"**Example answer covers (with its solution tiers):**\n{render_outline(section)}"})
+    # 4. The JSON reply format, when turns are structured
+    if structured:
+        prefix.append({"role": "system", "content": STRUCTURED_TURN_PROMPT})
+    # 5. Retrieval only: top the prefix up to the cacheable size from the opening of the example answer
+    missing = PROMPT_CACHE_MIN_TOKENS + PROMPT_CACHE_HEADROOM - count_message_tokens(prefix)
+    if not full_reference and missing > 0:
+        opening = truncate_to_tokens(render_section(section), missing)
+        if opening:
+            prefix.append({"role": "system", "content": f"**Example answer (opening):**\n{opening}"})
+    return tuple(prefix)
+
+
+def stage_prefix(problem_name: str, stage_name: str, full_reference: bool = True, structured: bool = False) -> tuple:
+    """
+    The static system messages for (problem, stage). Memoised per template version, so
+    a template edited on disk gets a fresh prefix and the stale one ages out of the cache.
+    With full_reference=False the stage material is reduced to an outline (see retrieval.py), and
+    structured=True adds the JSON reply format used by STRUCTURED_TURNS.
+    """
+    return _stage_prefix(problem_name, stage_name, registry.version(problem_name), full_reference, structured)
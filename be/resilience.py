@@ -0,0 +1,243 @@
+"""
+resilience.py – Deadlines, retries, hedging and failover for LLM calls.
+
+`call(attempt, model=..., purpose=...)` runs `await attempt(model)` under an
+overall deadline.  Retryable failures (timeouts, connection errors, 429s, 5xx)
+are retried with full-jitter exponential backoff.  With hedging on, a second
+identical request is fired once the first has taken longer than the recent
+p95 for that purpose, and whichever finishes first wins.  Every model has a
+circuit breaker: after LLM_BREAKER_THRESHOLD consecutive failures it opens
+for LLM_BREAKER_COOLDOWN seconds and calls go to LLM_FALLBACK_MODEL instead.
+Each attempt gets an even share of the deadline, so a hung attempt still
+leaves time for the retries.
+`stream` gives streamed calls the same breaker and failover, retrying only
+while no token has been sent yet.  A stream that sends no first token within
+LLM_STREAM_FIRST_TOKEN_TIMEOUT, or then stalls for LLM_STREAM_IDLE_TIMEOUT,
+counts as a timed-out attempt.
+"""
+
+import asyncio, os, random, time
+from collections import deque
+import openai
+import metrics
+
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "45"))            # seconds for the whole call, retries included
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))                 # extra attempts after the first
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.25"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_DELAY = os.getenv("LLM_HEDGE_DELAY", "")               # fixed seconds; empty = observed p95
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Seconds for one attempt: an even share of the deadline, so every retry gets its turn
+ATTEMPT_TIMEOUT = LLM_DEADLINE / (LLM_RETRIES + 1)
+LLM_STREAM_FIRST_TOKEN_TIMEOUT = float(os.getenv("LLM_STREAM_FIRST_TOKEN_TIMEOUT") or ATTEMPT_TIMEOUT)
+LLM_STREAM_IDLE_TIMEOUT = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", "10"))  # max gap between tokens
+# Hedge delay used until enough latencies have been observed
+DEFAULT_HEDGE_DELAY = 2.0
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+RETRYABLE = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError,
+             openai.InternalServerError, asyncio.TimeoutError)
+
+LLM_RETRIES_TOTAL = metrics.register(metrics.Counter("llm_retries_total", "LLM attempts retried after a transient failure."))
+LLM_HEDGES_TOTAL = metrics.register(metrics.Counter("llm_hedges_total", "Hedged LLM requests fired, by which request won."))
+LLM_FAILOVERS_TOTAL = metrics.register(metrics.Counter("llm_failovers_total", "LLM calls sent to the fallback model."))
+LLM_BREAKER_TRIPS = metrics.register(metrics.Counter("llm_breaker_trips_total", "Times a model's circuit breaker opened."))
+
+
+class DeadlineExceeded(openai.OpenAIError):
+    """The call did not finish within its deadline, retries included."""
+
+
+class CircuitOpen(openai.OpenAIError):
+    """Every configured model is failing; the call was not attempted."""
+
+
+def is_retryable(err: BaseException) -> bool:
+    return isinstance(err, RETRYABLE) or getattr(err, "retryable", False)
+
+
+class CircuitBreaker:
+    """Closed -> open after `threshold` consecutive failures; half-open (one probe) after `cooldown`."""
+    def __init__(self, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True     # let exactly one request find out whether the model recovered
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self, model: str = ""):
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                LLM_BREAKER_TRIPS.inc(model=model)
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Recent successful call durations per purpose, for the hedge delay."""
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self.samples = {}
+
+    def observe(self, purpose: str, seconds: float):
+        self.samples.setdefault(purpose, deque(maxlen=self.window)).append(seconds)
+
+    def p95(self, purpose: str):
+        samples = self.samples.get(purpose)
+        if not samples or len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+breakers = {}
+latencies = LatencyTracker()
+
+
+def breaker(model: str) -> CircuitBreaker:
+    if model not in breakers:
+        breakers[model] = CircuitBreaker()
+    return breakers[model]
+
+
+def choose_model(model: str) -> str:
+    """The primary model if its breaker lets the call through, else the fallback; CircuitOpen if neither."""
+    if breaker(model).allow():
+        return model
+    if LLM_FALLBACK_MODEL and LLM_FALLBACK_MODEL != model and breaker(LLM_FALLBACK_MODEL).allow():
+        LLM_FAILOVERS_TOTAL.inc()
+        return LLM_FALLBACK_MODEL
+    raise CircuitOpen(f"LLM unavailable: circuit open for {model}" + (f" and {LLM_FALLBACK_MODEL}" if LLM_FALLBACK_MODEL else ""))
+
+
+def hedge_delay(purpose: str) -> float:
+    if LLM_HEDGE_DELAY:
+        return float(LLM_HEDGE_DELAY)
+    p95 = latencies.p95(purpose)
+    return p95 if p95 is not None else DEFAULT_HEDGE_DELAY
+
+
+async def _hedged(attempt, model: str, purpose: str):
+    """attempt(model), plus a second copy if the first is still running after the hedge delay."""
+    first = asyncio.ensure_future(attempt(model))
+    if not LLM_HEDGE:
+        return await first
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay(purpose))
+        hedged = not done
+        if hedged:
+            tasks.add(asyncio.ensure_future(attempt(model)))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if hedged:
+                        LLM_HEDGES_TOTAL.inc(purpose=purpose, winner="first" if task is first else "hedge")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _with_retries(attempt, model: str, purpose: str, retries: int, attempt_timeout: float):
+    async def timed(target: str):
+        return await asyncio.wait_for(attempt(target), attempt_timeout)
+
+    for n in range(retries + 1):
+        target = choose_model(model)
+        start = time.monotonic()
+        try:
+            result = await _hedged(timed, target, purpose)
+        except asyncio.CancelledError:
+            breaker(target).probing = False     # a cancelled probe proves nothing either way
+            raise
+        except Exception as err:
+            if not is_retryable(err):
+                raise
+            breaker(target).record_failure(target)
+            if n == retries:
+                raise
+            LLM_RETRIES_TOTAL.inc(purpose=purpose)
+            await asyncio.sleep(random.uniform(0, LLM_RETRY_BASE_DELAY * 2 ** n))
+        else:
+            breaker(target).record_success()
+            latencies.observe(purpose, time.monotonic() - start)
+            return result
+
+
+async def call(attempt, *, model: str, purpose: str, deadline: float = LLM_DEADLINE, retries: int = LLM_RETRIES):
+    """Run `await attempt(model)` with retries, hedging and failover; DeadlineExceeded after `deadline` seconds."""
+    try:
+        return await asyncio.wait_for(_with_retries(attempt, model, purpose, retries, deadline / (retries + 1)), deadline)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"LLM call ({purpose}) exceeded its {deadline:g}s deadline")
+
+
+async def stream(open_stream, *, model: str, purpose: str, retries: int = LLM_RETRIES,
+                 first_token_timeout: float = LLM_STREAM_FIRST_TOKEN_TIMEOUT,
+                 idle_timeout: float = LLM_STREAM_IDLE_TIMEOUT):
+    """
+    Yield from `open_stream(model)`, retrying/failing over on transient errors before the first token.
+    DeadlineExceeded if no token arrives within first_token_timeout (on the last attempt) or the
+    stream then goes quiet for idle_timeout.
+    """
+    for n in range(retries + 1):
+        target = choose_model(model)
+        started = False
+        tokens = open_stream(target)
+        try:
+            while True:
+                try:
+                    token = await asyncio.wait_for(tokens.__anext__(), idle_timeout if started else first_token_timeout)
+                except StopAsyncIteration:
+                    break
+                started = True
+                yield token
+        except asyncio.CancelledError:
+            breaker(target).probing = False
+            raise
+        except Exception as err:
+            if not is_retryable(err):
+                raise
+            breaker(target).record_failure(target)
+            # Once text has reached the client a retry would repeat it, so only retry a silent failure
+            if started or n == retries:
+                if isinstance(err, asyncio.TimeoutError):
+                    waited = f"stalled for {idle_timeout:g}s" if started else f"sent nothing for {first_token_timeout:g}s"
+                    raise DeadlineExceeded(f"LLM stream ({purpose}) {waited}") from err
+                raise
+            LLM_RETRIES_TOTAL.inc(purpose=purpose)
+            await asyncio.sleep(random.uniform(0, LLM_RETRY_BASE_DELAY * 2 ** n))
+        else:
+            breaker(target).record_success()
+            return
+        finally:
+            await tokens.aclose()
@@ -0,0 +1,155 @@
+"""
+response_cache.py – Reuse interviewer replies to near-identical early-stage turns.
+
+Opening turns are much alike across candidates on the same problem ("so we
+need riders to request a ride and see an ETA...").  With RESPONSE_CACHE=1 a
+turn in one of RESPONSE_CACHE_STAGES is looked up before calling the model.
+Entries are scoped by (problem, stage, turn number, the interviewer's previous
+message), so a reply is only reused for the same question at the same point.
+Within a scope the candidate's message is compared by MinHash over word
+shingles (no embeddings, no network): a reply is reused when the estimated
+Jaccard similarity reaches RESPONSE_CACHE_THRESHOLD.  LSH buckets keep the
+lookup to a handful of comparisons.  Entries expire after RESPONSE_CACHE_TTL
+seconds and the least recently used are evicted past RESPONSE_CACHE_MAX_ENTRIES.
+"""
+
+import hashlib, os, re, struct, threading, time
+from collections import OrderedDict
+import metrics
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_STAGES = [s.strip() for s in os.getenv("RESPONSE_CACHE_STAGES", "Understanding the Problem").split(",") if s.strip()]
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.8"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+# Signature length and LSH banding (BANDS x ROWS == NUM_PERM); 16x4 finds pairs at 0.8 almost surely
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 2
+
+_WORD = re.compile(r"[a-z0-9]+")
+# Filler that varies between phrasings without changing what was said
+STOPWORDS = frozenset("a an the so and or but to of for from in on at by with can could would should will "
+                      "is are be been i we it that this there then also just like um ok okay well".split())
+_MASK = (1 << 64) - 1
+# Fixed hash family (not Python's per-process salted hash), so signatures are reproducible
+_PERMS = [struct.unpack("<QQ", hashlib.blake2b(str(i).encode(), digest_size=16).digest()) for i in range(NUM_PERM)]
+
+RESPONSE_CACHE_LOOKUPS = metrics.register(metrics.Counter("response_cache_lookups_total", "Response cache lookups by result (hit/miss)."))
+
+
+def normalize(text: str) -> list:
+    """Lowercase content words with simple plurals folded."""
+    words = []
+    for word in _WORD.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def shingles(text: str) -> set:
+    """Overlapping pairs of normalised words (single words for very short messages)."""
+    words = normalize(text)
+    if len(words) < SHINGLE_WORDS:
+        return set(words)
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def signature(text: str) -> tuple:
+    """MinHash signature of the text's shingles; empty for text with no words."""
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+              for s in shingles(text)]
+    if not hashes:
+        return ()
+    return tuple(min(((a | 1) * h + b) & _MASK for h in hashes) for a, b in _PERMS)
+
+
+def similarity(a: tuple, b: tuple) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+def scope_key(*parts) -> str:
+    return hashlib.sha256("\0".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("scope", "signature", "reply", "expires")
+
+    def __init__(self, scope: str, signature: tuple, reply: str, expires: float):
+        self.scope, self.signature, self.reply, self.expires = scope, signature, reply, expires
+
+
+class ResponseCache:
+    def __init__(self, threshold: float = RESPONSE_CACHE_THRESHOLD, ttl: float = RESPONSE_CACHE_TTL,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # entry id -> _Entry, least recently used first
+        self._buckets = {}              # (scope, band, band values) -> entry ids
+        self._ids = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _bands(scope: str, sig: tuple):
+        for band in range(BANDS):
+            yield scope, band, sig[band * ROWS:(band + 1) * ROWS]
+
+    def _drop(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        for bucket in self._bands(entry.scope, entry.signature):
+            ids = self._buckets.get(bucket)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._buckets[bucket]
+
+    def lookup(self, scope: str, message: str):
+        """The cached reply to the most similar earlier message in scope, or None below the threshold."""
+        sig = signature(message)
+        best, best_score = None, 0.0
+        with self._lock:
+            if sig:
+                now = time.monotonic()
+                candidates = set()
+                for bucket in self._bands(scope, sig):
+                    candidates |= self._buckets.get(bucket, set())
+                for entry_id in candidates:
+                    entry = self._entries[entry_id]
+                    if entry.expires <= now:
+                        self._drop(entry_id)
+                        continue
+                    score = similarity(sig, entry.signature)
+                    if score > best_score:
+                        best, best_score = entry_id, score
+            if best is None or best_score < self.threshold:
+                RESPONSE_CACHE_LOOKUPS.inc(result="miss")
+                return None
+            self._entries.move_to_end(best)
+            RESPONSE_CACHE_LOOKUPS.inc(result="hit")
+            metrics.annotate(response_cache_similarity=round(best_score, 3))
+            return self._entries[best].reply
+
+    def store(self, scope: str, message: str, reply: str):
+        sig = signature(message)
+        if not sig:
+            return
+        with self._lock:
+            self._ids += 1
+            self._entries[self._ids] = _Entry(scope, sig, reply, time.monotonic() + self.ttl)
+            for bucket in self._bands(scope, sig):
+                self._buckets.setdefault(bucket, set()).add(self._ids)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+
+response_cache = ResponseCache()
+metrics.register(metrics.Gauge("response_cache_entries", "Interviewer replies held in the response cache.", lambda: len(response_cache)))
@@ -0,0 +1,101 @@
+"""
+retrieval.py – Local BM25 index over template subsections.
+
+Each stage of a template is split into chunks (the stage intro, every H3
+subsection, and every Bad/Good/Great solution variant on its own), and a BM25
+index is built over them once per template version.  Each turn only the top-k
+chunks matching the candidate's message and diagram labels are put in the
+prompt, instead of the whole stage.  They go after the static prefix, which
+prompts.py keeps at a cacheable size on its own.  Everything runs in-process;
+no network.
+"""
+
+import math, os, re
+from collections import Counter
+from functools import lru_cache
+from context import truncate_to_tokens
+from prompts import render_section
+from template_registry import registry
+
+# Chunks injected per turn; 0 turns retrieval off and the whole stage is sent as before
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+# Cap on a single chunk so one long solution write-up can't crowd out the rest
+RETRIEVAL_CHUNK_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "800"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can could do does for from has have how i if in into is it its
+just let me more my no not of on or our should so that the their them then there these they
+this to us was we what when where which while who will with would you your
+""".split())
+
+
+def tokenize(text: str) -> list:
+    return [w for w in _WORD.findall(text.lower()) if w not in STOPWORDS and len(w) > 1]
+
+
+def chunk_stage(section) -> list:
+    """Split one stage of a template into (title, text) chunks, in document order."""
+    chunks = []
+    intro_text = render_section({"content": section.get("content", []), "figures": section.get("figures", [])})
+    if intro_text.strip():
+        chunks.append(("Overview", intro_text))
+    for title, sub in section.get("subsections", {}).items():
+        variants = {k: v for k, v in sub.items() if k not in ("content", "figures", "subsections")}
+        base = {k: v for k, v in sub.items() if k in ("content", "figures", "subsections")}
+        base_text = render_section(base, level=4)
+        if base_text.strip():
+            chunks.append((title, base_text))
+        # Solution variants and H6 blocks are retrievable on their own
+        for name, child in variants.items():
+            text = render_section(child, level=4)
+            if text.strip():
+                chunks.append((f"{title} › {name}", text))
+    return chunks
+
+
+class BM25Index:
+    def __init__(self, chunks: list):
+        self.chunks = [(title, truncate_to_tokens(text, RETRIEVAL_CHUNK_TOKENS)) for title, text in chunks]
+        # Titles are weighted by repeating them: they are the best summary of a chunk
+        docs = [tokenize(f"{title} {title} {text}") for title, text in self.chunks]
+        self.term_freqs = [Counter(doc) for doc in docs]
+        self.lengths = [len(doc) for doc in docs]
+        self.avg_length = (sum(self.lengths) / len(docs)) if docs else 0
+        df = Counter(term for doc in docs for term in set(doc))
+        n = len(docs)
+        self.idf = {term: math.log(1 + (n - f + 0.5) / (f + 0.5)) for term, f in df.items()}
+
+    def scores(self, query: str) -> list:
+        terms = [t for t in set(tokenize(query)) if t in self.idf]
+        scores = []
+        for tf, length in zip(self.term_freqs, self.lengths):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self.avg_length or 1))
+            scores.append(sum(self.idf[t] * tf[t] * (BM25_K1 + 1) / (tf[t] + norm) for t in terms if t in tf))
+        return scores
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K) -> list:
+        """Top-k (title, text) chunks for query, returned in document order. Falls back to the first k."""
+        scores = self.scores(query)
+        ranked = sorted((i for i, s in enumerate(scores) if s > 0), key=lambda i: -scores[i])[:k]
+        if not ranked:
+            ranked = range(min(k, len(self.chunks)))
+        return [self.chunks[i] for i in sorted(ranked)]
+
+
+@lru_cache(maxsize=256)
+def _index(problem_name: str, stage_name: str, version: int) -> BM25Index:
+    return BM25Index(chunk_stage(registry.get(problem_name).get(stage_name, {})))
+
+
+def get_index(problem_name: str, stage_name: str) -> BM25Index:
+    """The index for (problem, stage), rebuilt when the template changes on disk."""
+    return _index(problem_name, stage_name, registry.version(problem_name))
+
+
+def retrieve(problem_name: str, stage_name: str, query: str, k: int = RETRIEVAL_TOP_K) -> str:
+    """Markdown block of the top-k reference chunks for this turn."""
+    chunks = get_index(problem_name, stage_name).search(query, k)
+    return "\n\n".join(f"### {title}\n{text}" for title, text in chunks)
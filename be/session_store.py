@@ -0,0 +1,237 @@
+"""
+session_store.py – Bounded in-memory store for interview sessions.
+
+Sessions are kept in LRU order and evicted when idle for longer than
+SESSION_IDLE_TTL, when there are more than SESSION_MAX_COUNT of them, or when
+their estimated footprint exceeds SESSION_MEMORY_LIMIT_MB; a session with a turn
+in flight is pinned and never evicted for space.  Archived stage transcripts
+(`allHistory`) are written compressed to this process's own directory under
+SESSION_SPILL_DIR as soon as a stage ends and are only read back when something
+asks for them; both happen in a worker thread, off the event loop.
+With SESSION_BACKEND=sqlite or redis, shared_sessions.py stores them instead.
+"""
+
+import asyncio, gzip, json, os, shutil, tempfile, threading, time, uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", str(2 * 60 * 60)))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+SESSION_MEMORY_LIMIT_MB = float(os.getenv("SESSION_MEMORY_LIMIT_MB", "512"))
+SESSION_SPILL_DIR = os.getenv("SESSION_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "design_agent_sessions")
+SESSION_SWEEP_INTERVAL = 60
+# How long a request waits for another worker to finish the previous stage's summary
+SESSION_SUMMARY_WAIT = float(os.getenv("SESSION_SUMMARY_WAIT", "30"))
+SUMMARY_POLL_INTERVAL = 0.1
+
+
+_spill_dirs = {}   # pid -> this process's directory under SESSION_SPILL_DIR
+
+
+def process_spill_dir() -> str:
+    """<SESSION_SPILL_DIR>/<pid>-<random>: where this process spills, so workers never touch each other's files."""
+    pid = os.getpid()   # looked up per call, so a forked worker gets its own
+    if pid not in _spill_dirs:
+        _spill_dirs[pid] = os.path.join(SESSION_SPILL_DIR, f"{pid}-{uuid.uuid4().hex}")
+    return _spill_dirs[pid]
+
+
+def history_bytes(history) -> int:
+    """Rough in-memory footprint of a list of chat messages."""
+    return sum(len(m.get("content", "")) + 64 for m in history)
+
+
+class ArchivedHistory:
+    """
+    Record of finished stage transcripts, spilled to disk as gzip'd JSON. `append` and `fetch` are
+    async and do the file I/O in a worker thread; stages are loaded back lazily on access.
+    Each stage can also carry its summary once it has been written.
+    """
+    def __init__(self, spill_dir: str = None):
+        self.spill_dir = spill_dir or process_spill_dir()
+        self.key = uuid.uuid4().hex
+        self._paths = []
+        self._summaries = {}
+
+    def _path(self, i: int) -> str:
+        return os.path.join(self.spill_dir, f"{self.key}-{i}.json.gz")
+
+    def _write(self, path: str, stage_history: list):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(stage_history, f, ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    def _read(path: str) -> list:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    async def append(self, stage_history: list):
+        path = self._path(len(self._paths))
+        await asyncio.to_thread(self._write, path, stage_history)
+        self._paths.append(path)   # only once the file is complete
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    async def fetch(self, i: int) -> list:
+        """Stage i's transcript."""
+        return await asyncio.to_thread(self._read, self._paths[i])
+
+    async def set_summary(self, i: int, summary: str):
+        self._summaries[i] = summary
+
+    async def get_summary(self, i: int):
+        return self._summaries.get(i)
+
+    async def wait_summary(self, i: int, timeout: float = SESSION_SUMMARY_WAIT):
+        """The summary of stage i, waiting up to timeout for it to be written; None if it never is."""
+        deadline = time.monotonic() + timeout
+        while True:
+            summary = await self.get_summary(i)
+            if summary is not None or time.monotonic() >= deadline:
+                return summary
+            await asyncio.sleep(SUMMARY_POLL_INTERVAL)
+
+    def discard(self):
+        """Delete the spilled files; called when the owning session goes away."""
+        for path in self._paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._paths = []
+
+
+class SessionStore:
+    """dict-like user_id -> SessionState mapping with idle-TTL, LRU and memory-ceiling eviction."""
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL, max_count: int = SESSION_MAX_COUNT,
+                 memory_limit_mb: float = SESSION_MEMORY_LIMIT_MB):
+        self.idle_ttl = idle_ttl
+        self.max_count = max_count
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self._sessions = OrderedDict()   # user_id -> session, least recently used first
+        self._last_used = {}             # user_id -> monotonic time of last access
+        self._sizes = {}                 # user_id -> estimated bytes
+        self.total_bytes = 0
+        self._pins = {}                  # user_id -> turns in flight
+        self._lock = threading.RLock()
+
+    def __contains__(self, user_id) -> bool:
+        with self._lock:
+            self._expire(user_id)
+            return user_id in self._sessions
+
+    def __getitem__(self, user_id):
+        with self._lock:
+            self._expire(user_id)
+            session = self._sessions[user_id]
+            self._sessions.move_to_end(user_id)
+            self._last_used[user_id] = time.monotonic()
+            return session
+
+    def get(self, user_id, default=None):
+        try:
+            return self[user_id]
+        except KeyError:
+            return default
+
+    def __setitem__(self, user_id, session):
+        with self._lock:
+            if user_id in self._sessions:
+                self._drop(user_id)
+            self._sessions[user_id] = session
+            self._last_used[user_id] = time.monotonic()
+            self._sizes[user_id] = 0
+            self.touch(user_id)
+
+    def __delitem__(self, user_id):
+        with self._lock:
+            if user_id not in self._sessions:
+                raise KeyError(user_id)
+            self._drop(user_id)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def new_archive(self, user_id) -> ArchivedHistory:
+        """Archive for a new session's finished stages."""
+        return ArchivedHistory()
+
+    def pin(self, user_id):
+        """Keep a session through a turn in flight: it is not evicted for count or memory until unpinned."""
+        with self._lock:
+            self._pins[user_id] = self._pins.get(user_id, 0) + 1
+
+    def unpin(self, user_id):
+        with self._lock:
+            count = self._pins.pop(user_id, 0) - 1
+            if count > 0:
+                self._pins[user_id] = count
+
+    @contextmanager
+    def pinned(self, user_id):
+        self.pin(user_id)
+        try:
+            yield
+        finally:
+            self.unpin(user_id)
+
+    # The async API the app uses, shared with shared_sessions.SharedSessionStore
+    async def load(self, user_id):
+        return self.get(user_id)
+
+    async def create(self, user_id, session):
+        self[user_id] = session
+
+    async def save(self, user_id, session):
+        """Record that a session changed. Sessions live in this process, so this is just touch()."""
+        self.touch(user_id)
+
+    def touch(self, user_id):
+        """Re-measure a session after it changed and evict others if we are now over a limit."""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return
+            size = history_bytes(session.history)
+            self.total_bytes += size - self._sizes.get(user_id, 0)
+            self._sizes[user_id] = size
+            self._enforce_limits(keep=user_id)
+
+    async def sweep(self):
+        """Evict every idle session and anything over the count/memory limits."""
+        with self._lock:
+            cutoff = time.monotonic() - self.idle_ttl
+            for user_id in [u for u, t in self._last_used.items() if t < cutoff]:
+                self._drop(user_id, idle=True)
+            self._enforce_limits()
+
+    def _expire(self, user_id):
+        last = self._last_used.get(user_id)
+        if last is not None and time.monotonic() - last > self.idle_ttl:
+            self._drop(user_id, idle=True)
+
+    def _enforce_limits(self, keep=None):
+        # Oldest first; never evict a session that is being served right now
+        for user_id in list(self._sessions):
+            if len(self._sessions) <= self.max_count and self.total_bytes <= self.memory_limit:
+                break
+            if user_id != keep and user_id not in self._pins:
+                self._drop(user_id)
+
+    def _drop(self, user_id, idle: bool = False):
+        session = self._sessions.pop(user_id)
+        self._last_used.pop(user_id, None)
+        self.total_bytes -= self._sizes.pop(user_id, 0)
+        if idle:
+            # No turn runs for SESSION_IDLE_TTL, so a pin still held here was never released
+            self._pins.pop(user_id, None)
+        archive = getattr(session, "allHistory", None)
+        if isinstance(archive, ArchivedHistory):
+            archive.discard()
+
+
+def remove_spill_dir():
+    """Remove this process's spilled transcripts on shutdown; other workers' directories are left alone."""
+    shutil.rmtree(process_spill_dir(), ignore_errors=True)
@@ -0,0 +1,365 @@
+"""
+shared_sessions.py – Interview sessions kept outside the worker process.
+
+With SESSION_BACKEND=sqlite (one WAL-mode database file, shared by every
+worker on the host) or SESSION_BACKEND=redis (shared across hosts; needs the
+`redis` package), a session is stored as zlib-compressed compact JSON under a
+version number.  Each request loads the session, and saving it back only
+succeeds if nobody else saved in between; otherwise SessionConflict is raised
+and the request is answered with 409 so the client can resend.  Backend calls
+never block the event loop: SQLite runs in a worker thread and Redis goes
+through its asyncio client.  Finished stage
+transcripts and their summaries are stored next to the session, so any worker
+can pick up a summary another one wrote; a stage is only written once the save
+that recorded it has won.
+
+The default, SESSION_BACKEND=memory, keeps the single-process SessionStore.
+"""
+
+import asyncio, json, os, sqlite3, threading, time, uuid, zlib
+from contextlib import contextmanager
+from session_store import SessionStore, ArchivedHistory, SESSION_IDLE_TTL
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH") or os.path.join(BASE_DIR, ".cache", "sessions.db")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = "design_agent:"
+
+
+class SessionConflict(Exception):
+    """The session was saved by another request since it was loaded."""
+
+
+def pack(obj) -> bytes:
+    return zlib.compress(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def unpack(blob: bytes):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+# ------------------------------------------------------------------ backends
+class SQLiteBackend:
+    """
+    Sessions and archived stages in one SQLite database in WAL mode (safe across worker processes).
+    Queries run in a worker thread so a slow disk or a lock wait never stalls the event loop.
+    """
+    def __init__(self, path: str = SESSION_DB_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id TEXT PRIMARY KEY, version INTEGER NOT NULL, updated REAL NOT NULL, data BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS archives (
+                user_id TEXT NOT NULL, archive TEXT NOT NULL, idx INTEGER NOT NULL, data BLOB, summary TEXT,
+                PRIMARY KEY (user_id, archive, idx));
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+        """)
+
+    def _fetchone(self, sql: str, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchone()
+
+    def _transaction(self, *statements):
+        """Run (sql, args) statements as one transaction; returns the last statement's first row."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for sql, args in statements:
+                    rows = self._db.execute(sql, args).fetchall()
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        return rows[0] if rows else None
+
+    async def load(self, user_id: str):
+        """(version, blob), or None if there is no such session."""
+        return await asyncio.to_thread(self._fetchone, "SELECT version, data FROM sessions WHERE user_id = ?", (user_id,))
+
+    # Insert, or overwrite while still counting the version up, so a copy loaded before can never match it again
+    UPSERT = ("INSERT INTO sessions (user_id, version, updated, data) VALUES (?, 1, ?, ?) "
+              "ON CONFLICT (user_id) DO UPDATE SET version = version + 1, updated = excluded.updated, "
+              "data = excluded.data RETURNING version")
+
+    async def save(self, user_id: str, blob: bytes, expected) -> int:
+        """Write blob and return its new version; with expected set, only if the stored version still matches."""
+        if expected is None:
+            return (await asyncio.to_thread(self._fetchone, self.UPSERT, (user_id, time.time(), blob)))[0]
+        row = await asyncio.to_thread(
+            self._fetchone,
+            "UPDATE sessions SET version = version + 1, updated = ?, data = ? WHERE user_id = ? AND version = ? "
+            "RETURNING version", (time.time(), blob, user_id, expected))
+        if row is None:
+            raise SessionConflict(user_id)
+        return row[0]
+
+    async def replace(self, user_id: str, blob: bytes) -> int:
+        """Store a new session in place of the old one and its archive; the version keeps counting up."""
+        row = await asyncio.to_thread(self._transaction,
+                                      ("DELETE FROM archives WHERE user_id = ?", (user_id,)),
+                                      (self.UPSERT, (user_id, time.time(), blob)))
+        return row[0]
+
+    async def delete(self, user_id: str):
+        await asyncio.to_thread(self._transaction,
+                                ("DELETE FROM sessions WHERE user_id = ?", (user_id,)),
+                                ("DELETE FROM archives WHERE user_id = ?", (user_id,)))
+
+    async def sweep(self, idle_ttl: float):
+        cutoff = time.time() - idle_ttl
+        await asyncio.to_thread(
+            self._transaction,
+            ("DELETE FROM archives WHERE user_id IN (SELECT user_id FROM sessions WHERE updated < ?)", (cutoff,)),
+            ("DELETE FROM sessions WHERE updated < ?", (cutoff,)))
+
+    async def count(self) -> int:
+        return (await asyncio.to_thread(self._fetchone, "SELECT COUNT(*) FROM sessions"))[0]
+
+    async def put_stages(self, user_id: str, archive: str, rows: dict):
+        """Write stages {idx: (blob, summary or None)}; a summary already stored for a stage is kept."""
+        await asyncio.to_thread(self._transaction, *(
+            ("INSERT INTO archives (user_id, archive, idx, data, summary) VALUES (?, ?, ?, ?, ?) "
+             "ON CONFLICT (user_id, archive, idx) DO UPDATE SET data = excluded.data, "
+             "summary = COALESCE(excluded.summary, archives.summary)", (user_id, archive, idx, blob, summary))
+            for idx, (blob, summary) in rows.items()))
+
+    async def get_stage(self, user_id: str, archive: str, idx: int):
+        row = await asyncio.to_thread(self._fetchone,
+                                      "SELECT data FROM archives WHERE user_id = ? AND archive = ? AND idx = ?",
+                                      (user_id, archive, idx))
+        return row[0] if row else None
+
+    async def put_summary(self, user_id: str, archive: str, idx: int, summary: str):
+        # The summary can finish before the stage row is flushed, so it may create the row
+        await asyncio.to_thread(self._fetchone,
+                                "INSERT INTO archives (user_id, archive, idx, summary) VALUES (?, ?, ?, ?) "
+                                "ON CONFLICT (user_id, archive, idx) DO UPDATE SET summary = excluded.summary",
+                                (user_id, archive, idx, summary))
+
+    async def get_summary(self, user_id: str, archive: str, idx: int):
+        row = await asyncio.to_thread(self._fetchone,
+                                      "SELECT summary FROM archives WHERE user_id = ? AND archive = ? AND idx = ?",
+                                      (user_id, archive, idx))
+        return row[0] if row else None
+
+
+class RedisBackend:
+    """
+    Sessions in a Redis-compatible server, through the asyncio client: one hash per session
+    (version, data) and one per session's archive. Both expire after the idle TTL. A sorted set
+    of user ids scored by last save keeps the live count without scanning the keyspace.
+    """
+    # Compare-and-set: bump the version only if it is still the one the caller loaded. ARGV[6] == '1'
+    # replaces the session with a new one and drops the old archive; the version still counts up
+    SAVE_SCRIPT = """
+        local current = redis.call('HGET', KEYS[1], 'version')
+        if ARGV[1] ~= '' and current ~= ARGV[1] then return -1 end
+        if ARGV[6] == '1' then redis.call('DEL', KEYS[2]) end
+        local version = (tonumber(current) or 0) + 1
+        redis.call('HSET', KEYS[1], 'version', version, 'data', ARGV[2])
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+        redis.call('EXPIRE', KEYS[2], ARGV[3])
+        redis.call('ZADD', KEYS[3], ARGV[4], ARGV[5])
+        return version
+    """
+
+    def __init__(self, url: str = SESSION_REDIS_URL, idle_ttl: float = SESSION_IDLE_TTL):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("SESSION_BACKEND=redis needs the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = int(idle_ttl)
+        self.index = f"{REDIS_PREFIX}live"
+        self._save = self.client.register_script(self.SAVE_SCRIPT)
+
+    def _keys(self, user_id: str):
+        return f"{REDIS_PREFIX}session:{user_id}", f"{REDIS_PREFIX}archive:{user_id}"
+
+    async def load(self, user_id: str):
+        version, data = await self.client.hmget(self._keys(user_id)[0], "version", "data")
+        return None if version is None else (int(version), data)
+
+    async def save(self, user_id: str, blob: bytes, expected, replace: bool = False) -> int:
+        version = await self._save(keys=[*self._keys(user_id), self.index],
+                                   args=["" if expected is None else expected, blob, self.ttl, time.time(), user_id,
+                                         "1" if replace else "0"])
+        if version == -1:
+            raise SessionConflict(user_id)
+        return int(version)
+
+    async def replace(self, user_id: str, blob: bytes) -> int:
+        return await self.save(user_id, blob, None, replace=True)
+
+    async def delete(self, user_id: str):
+        await self.client.pipeline().delete(*self._keys(user_id)).zrem(self.index, user_id).execute()
+
+    async def sweep(self, idle_ttl: float):
+        # The hashes expire by themselves; only their index entries need trimming
+        await self.client.zremrangebyscore(self.index, "-inf", time.time() - idle_ttl)
+
+    async def count(self) -> int:
+        return await self.client.zcount(self.index, time.time() - self.ttl, "+inf")
+
+    async def put_stages(self, user_id: str, archive: str, rows: dict):
+        key = self._keys(user_id)[1]
+        fields = {}
+        for idx, (blob, summary) in rows.items():
+            fields[f"{archive}:{idx}"] = blob
+            if summary is not None:
+                fields[f"{archive}:{idx}:summary"] = summary
+        await self.client.pipeline().hset(key, mapping=fields).expire(key, self.ttl).execute()
+
+    async def get_stage(self, user_id: str, archive: str, idx: int):
+        return await self.client.hget(self._keys(user_id)[1], f"{archive}:{idx}")
+
+    async def put_summary(self, user_id: str, archive: str, idx: int, summary: str):
+        await self.client.hset(self._keys(user_id)[1], f"{archive}:{idx}:summary", summary)
+
+    async def get_summary(self, user_id: str, archive: str, idx: int):
+        summary = await self.client.hget(self._keys(user_id)[1], f"{archive}:{idx}:summary")
+        return summary.decode("utf-8") if summary is not None else None
+
+
+BACKENDS = {"sqlite": SQLiteBackend, "redis": RedisBackend}
+
+
+# ------------------------------------------------------------------ store
+class SharedArchive(ArchivedHistory):
+    """
+    ArchivedHistory whose stages and summaries live in the shared backend. Stages appended during
+    a turn are held here and only written once the session save that records them has succeeded,
+    so a request that loses the compare-and-set leaves nothing behind.
+    """
+    def __init__(self, backend, user_id: str, key: str = None, length: int = 0):
+        self.backend = backend
+        self.user_id = user_id
+        self.key = key or uuid.uuid4().hex
+        self.length = length
+        self._pending = {}        # idx -> [blob, summary] of stages not written yet
+        self._abandoned = False   # the save lost: drop whatever this copy still wants to write
+
+    async def append(self, stage_history: list):
+        self._pending[self.length] = [pack(stage_history), None]
+        self.length += 1
+
+    def __len__(self) -> int:
+        return self.length
+
+    def _index(self, i: int) -> int:
+        if not -self.length <= i < self.length:
+            raise IndexError(i)
+        return i % self.length
+
+    async def fetch(self, i: int) -> list:
+        i = self._index(i)
+        if i in self._pending:
+            return unpack(self._pending[i][0])
+        blob = await self.backend.get_stage(self.user_id, self.key, i)
+        return unpack(blob) if blob is not None else []
+
+    async def set_summary(self, i: int, summary: str):
+        if self._abandoned:
+            return
+        if i in self._pending:
+            self._pending[i][1] = summary
+            return
+        await self.backend.put_summary(self.user_id, self.key, i, summary)
+
+    async def get_summary(self, i: int):
+        if i in self._pending:
+            return self._pending[i][1]
+        return await self.backend.get_summary(self.user_id, self.key, i)
+
+    async def flush(self):
+        """Write the stages appended since the last save; called once that save has succeeded."""
+        rows, self._pending = self._pending, {}
+        if rows:
+            await self.backend.put_stages(self.user_id, self.key, rows)
+
+    def abandon(self):
+        self._pending = {}
+        self._abandoned = True
+
+    def discard(self):
+        pass    # rows go with the session in backend.delete / sweep
+
+
+class SharedSessionStore:
+    """
+    Same async interface as SessionStore (load / create / save / sweep), backed by a shared backend.
+    Every load returns a freshly decoded session tagged with the version it was loaded at; `save`
+    writes it back only if that version is still current. decode(data, archive) rebuilds a session
+    from its to_dict() form.
+    """
+    total_bytes = 0     # nothing is held in this process
+
+    def __init__(self, backend, decode, idle_ttl: float = SESSION_IDLE_TTL):
+        self.backend = backend
+        self.decode = decode
+        self.idle_ttl = idle_ttl
+        self.live = 0   # session count as of the last sweep
+
+    async def load(self, user_id):
+        """The stored session, or None."""
+        row = await self.backend.load(user_id)
+        if row is None:
+            return None
+        version, blob = row
+        data = unpack(blob)
+        archive = SharedArchive(self.backend, user_id, data["archive"]["key"], data["archive"]["len"])
+        session = self.decode(data, archive)
+        session.version = version
+        return session
+
+    async def create(self, user_id, session):
+        """
+        Store a new session, replacing whatever was there (and its archive). The stored version is
+        bumped rather than restarted, so a request still holding the old session can't save over it.
+        """
+        session.version = await self.backend.replace(user_id, pack(session.to_dict()))
+        await session.allHistory.flush()
+
+    def __len__(self) -> int:
+        return self.live
+
+    def pin(self, user_id):
+        pass    # nothing is held in this process, so there is nothing to evict
+
+    def unpin(self, user_id):
+        pass
+
+    @contextmanager
+    def pinned(self, user_id):
+        yield
+
+    def new_archive(self, user_id) -> SharedArchive:
+        return SharedArchive(self.backend, user_id)
+
+    async def save(self, user_id, session):
+        """Write the session back; raises SessionConflict if another request saved it first."""
+        try:
+            session.version = await self.backend.save(user_id, pack(session.to_dict()), session.version)
+        except SessionConflict:
+            session.allHistory.abandon()
+            raise
+        await session.allHistory.flush()
+
+    async def sweep(self):
+        await self.backend.sweep(self.idle_ttl)
+        self.live = await self.backend.count()
+
+
+def open_session_store(decode, backend: str = SESSION_BACKEND):
+    """The session store selected by SESSION_BACKEND."""
+    if backend == "memory":
+        return SessionStore()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown SESSION_BACKEND {backend!r}; expected memory or one of {sorted(BACKENDS)}")
+    return SharedSessionStore(BACKENDS[backend](), decode)
@@ -0,0 +1,96 @@
+"""
+singleflight.py – Coalesce identical concurrent async calls.
+
+`SingleFlight.do(key, fn)` runs `fn()` once per key while it is in flight and
+hands every concurrent caller the same result (or exception).  A successful
+result is also served for `grace` seconds after it completes (per call, if the
+caller overrides it), which absorbs the tail of a burst of resends; `forget`
+ends that early.  The shared call is only cancelled once every caller waiting
+on it has gone.
+"""
+
+import asyncio, hashlib, json, time
+
+
+def call_key(**parts) -> str:
+    """Canonical hash of a call's inputs (JSON with sorted keys)."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("task", "waiters", "expires", "grace")
+
+    def __init__(self, task, grace: float):
+        self.task = task
+        self.waiters = 0
+        self.expires = None   # monotonic time the finished result stops being served
+        self.grace = grace
+
+
+class SingleFlight:
+    def __init__(self, grace: float = 0.0):
+        self.grace = grace
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def running(self, key: str) -> bool:
+        """Whether a call for key is still in flight (a finished one inside its grace window is not)."""
+        call = self._calls.get(key)
+        return call is not None and not call.task.done()
+
+    def waiters(self, key: str) -> int:
+        """How many callers are awaiting the call for key right now."""
+        call = self._calls.get(key)
+        return call.waiters if call is not None else 0
+
+    def finished(self, key: str) -> bool:
+        """Whether the call for key has finished but its result is still being served."""
+        call = self._calls.get(key)
+        return call is not None and call.task.done()
+
+    def forget(self, key: str):
+        """Stop serving the finished result for key; a call still in flight is left alone."""
+        call = self._calls.get(key)
+        if call is not None and call.task.done():
+            self._forget(key, call)
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _finished(self, key: str, call: _Call):
+        task = call.task
+        if task.cancelled() or task.exception() is not None or call.grace <= 0:
+            # Failures are shared with whoever was waiting, but never replayed to later callers
+            self._forget(key, call)
+        else:
+            call.expires = time.monotonic() + call.grace
+            asyncio.get_running_loop().call_later(call.grace, self._forget, key, call)
+
+    async def do(self, key: str, fn, grace: float = None):
+        """
+        Await fn() or join an identical call already in flight (or finished within the grace window).
+        `grace` overrides the window for a call this starts; 0 shares it only while it is in flight.
+        Returns (result, shared) where shared is False only for the caller that actually ran fn.
+        """
+        call = self._calls.get(key)
+        if call is not None and call.expires is not None and call.expires <= time.monotonic():
+            self._forget(key, call)
+            call = None
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()), self.grace if grace is None else grace)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _, key=key, call=call: self._finished(key, call))
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        except asyncio.CancelledError:
+            if not call.task.done() and call.waiters == 1:
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
@@ -0,0 +1,165 @@
+"""
+template_bundle.py – Precompiled, memory-mapped template bundle.
+
+`python template_bundle.py` compiles every templates/<problem>.json into one
+file: each stage is whitespace-cleaned, serialised as compact JSON and
+zlib-compressed, with the stage head (content, figures) and every subsection
+stored as separate blobs.  A JSON index at the front holds the offset of every
+blob and the mtime of the source file it was built from.
+
+At runtime the bundle is memory-mapped and only the index is parsed; a stage
+is decoded the first time a session asks for it.  TemplateRegistry serves a
+problem from the bundle while its source mtime still matches and falls back
+to the JSON file otherwise, so a stale or missing bundle is never wrong, only
+slower.
+
+Layout:  MAGIC | index length (8 bytes, little-endian) | index JSON | blobs
+"""
+
+import argparse, json, mmap, os, struct, threading, zlib
+from collections.abc import Mapping
+
+MAGIC = b"DABUNDLE1\n"
+_LENGTH = struct.Struct("<Q")
+
+
+def _pack(obj) -> bytes:
+    return zlib.compress(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+
+
+# ------------------------------------------------------------------ build
+def build(templates_dir: str, out_path: str, clean=None) -> dict:
+    """Compile every template in templates_dir into out_path; returns the index."""
+    if clean is None:
+        from template_registry import clean_whitespace as clean
+    index, blobs, offset = {}, [], 0
+
+    def add(obj) -> list:
+        nonlocal offset
+        blob = _pack(obj)
+        blobs.append(blob)
+        offset += len(blob)
+        return [offset - len(blob), len(blob)]
+
+    for name in sorted(f[:-5] for f in os.listdir(templates_dir) if f.endswith(".json")):
+        path = os.path.join(templates_dir, f"{name}.json")
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, "r", encoding="utf-8") as f:
+            data = clean(json.load(f))
+        stages = {}
+        for stage, section in data.items():
+            if isinstance(section, dict):
+                head = {k: v for k, v in section.items() if k != "subsections"}
+                subsections = [[title, *add(sub)] for title, sub in section.get("subsections", {}).items()]
+                stages[stage] = {"keys": list(section), "head": add(head), "subsections": subsections}
+            else:
+                stages[stage] = {"value": add(section)}
+        index[name] = {"mtime_ns": mtime, "stages": stages}
+
+    header = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp = f"{out_path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + _LENGTH.pack(len(header)) + header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, out_path)
+    return index
+
+
+# ------------------------------------------------------------------ runtime
+class TemplateBundle:
+    """Read-only view of a bundle file; only the index is parsed up front."""
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a template bundle")
+        start = len(MAGIC) + _LENGTH.size
+        (length,) = _LENGTH.unpack(self._mmap[len(MAGIC):start])
+        self.index = json.loads(self._mmap[start:start + length].decode("utf-8"))
+        self._data_start = start + length
+        self.mtime_ns = os.stat(path).st_mtime_ns
+
+    def _blob(self, offset: int, length: int):
+        start = self._data_start + offset
+        return json.loads(zlib.decompress(self._mmap[start:start + length]).decode("utf-8"))
+
+    def source_mtime(self, problem_name: str):
+        entry = self.index.get(problem_name)
+        return entry["mtime_ns"] if entry else None
+
+    def stage_names(self, problem_name: str) -> list:
+        return list(self.index[problem_name]["stages"])
+
+    def subsection_titles(self, problem_name: str, stage_name: str) -> list:
+        """Subsection titles straight from the index, without decoding anything."""
+        return [title for title, _, _ in self.index[problem_name]["stages"][stage_name].get("subsections", [])]
+
+    def subsection(self, problem_name: str, stage_name: str, title: str):
+        for name, offset, length in self.index[problem_name]["stages"][stage_name].get("subsections", []):
+            if name == title:
+                return self._blob(offset, length)
+        raise KeyError(title)
+
+    def stage(self, problem_name: str, stage_name: str):
+        """Decode one whole stage, shaped exactly like the JSON template's section."""
+        entry = self.index[problem_name]["stages"][stage_name]
+        if "value" in entry:
+            return self._blob(*entry["value"])
+        section = self._blob(*entry["head"])
+        if "subsections" in entry["keys"]:
+            section["subsections"] = {title: self._blob(offset, length)
+                                      for title, offset, length in entry["subsections"]}
+        # Same key order as the source, so rendered prompts are byte-identical
+        return {key: section[key] for key in entry["keys"]}
+
+    def close(self):
+        self._mmap.close()
+
+
+class LazyTemplate(Mapping):
+    """
+    A problem's template backed by a bundle: behaves like the frozen dict from the JSON
+    loader, but each stage is decoded (and frozen) on first access.
+    """
+    def __init__(self, bundle: TemplateBundle, problem_name: str, freeze):
+        self._bundle = bundle
+        self._problem = problem_name
+        self._freeze = freeze
+        self._names = bundle.stage_names(problem_name)
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, stage_name: str):
+        if stage_name not in self._stages:
+            if stage_name not in self._names:
+                raise KeyError(stage_name)
+            with self._lock:
+                if stage_name not in self._stages:
+                    self._stages[stage_name] = self._freeze(self._bundle.stage(self._problem, stage_name))
+        return self._stages[stage_name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def decoded(self) -> list:
+        """Stages decoded so far."""
+        return list(self._stages)
+
+
+if __name__ == "__main__":
+    from template_registry import TEMPLATES_DIR, TEMPLATE_BUNDLE
+    parser = argparse.ArgumentParser(description="Compile templates/*.json into a memory-mapped bundle")
+    parser.add_argument("--templates-dir", default=TEMPLATES_DIR)
+    parser.add_argument("--out", default=TEMPLATE_BUNDLE)
+    args = parser.parse_args()
+
+    index = build(args.templates_dir, args.out)
+    source = sum(os.path.getsize(os.path.join(args.templates_dir, f"{name}.json")) for name in index)
+    print(f"{len(index)} templates, {source} bytes of JSON -> {os.path.getsize(args.out)} bytes in {args.out}")
@@ -0,0 +1,147 @@
+"""
+template_registry.py – Load, normalise and share the interview templates.
+
+Every templates/<problem>.json is parsed and whitespace-cleaned once, frozen,
+and the same read-only copy is handed to every session on that problem.
+A file is only re-read when its mtime changes on disk.  When a compiled bundle
+(see template_bundle.py) is up to date for a problem, that problem is served
+from it instead and each stage is decoded only when first used.
+"""
+
+import json, os, re, threading
+from textwrap import dedent
+from template_bundle import TemplateBundle, LazyTemplate
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+# Built by `python template_bundle.py`; set to an empty string to always read the JSON files
+TEMPLATE_BUNDLE = os.getenv("TEMPLATE_BUNDLE", os.path.join(BASE_DIR, ".cache", "templates.bundle"))
+
+
+# ------------------------------------------------------------------ cleaning
+_SPACES = re.compile(r"[ \t]{2,}")
+_BLANK_LINES = re.compile(r"\n{2,}")
+
+
+def clean_string(s: str) -> str:
+    # 1) Dedent and trim (dedent is a no-op unless some line starts with whitespace)
+    text = dedent(s).strip() if s[:1] in (" ", "\t") or "\n " in s or "\n\t" in s else s.strip()
+    # 2) Collapse internal spaces/tabs (but keep newlines)
+    #    Replace two or more spaces/tabs with one space
+    text = _SPACES.sub(" ", text)
+    # 3) Collapse multiple blank lines to a single newline
+    text = _BLANK_LINES.sub("\n", text)
+    return text
+
+
+def clean_whitespace(obj):
+    if isinstance(obj, str):
+        return clean_string(obj)
+    elif isinstance(obj, list):
+        return [clean_whitespace(item) for item in obj]
+    elif isinstance(obj, dict):
+        return {k: clean_whitespace(v) for k, v in obj.items()}
+    else:
+        return obj
+
+
+# ------------------------------------------------------------------ freezing
+def _readonly(self, *args, **kwargs):
+    raise TypeError("template data is shared between sessions and cannot be modified")
+
+
+class FrozenDict(dict):
+    """A dict that refuses mutation but still prints/serialises like a dict."""
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+
+class FrozenList(list):
+    """A list that refuses mutation but still prints/serialises like a list."""
+    __setitem__ = __delitem__ = append = extend = insert = pop = remove = _readonly
+    clear = sort = reverse = __iadd__ = __imul__ = _readonly
+
+
+def freeze(obj):
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    elif isinstance(obj, list):
+        return FrozenList(freeze(item) for item in obj)
+    else:
+        return obj
+
+
+# ------------------------------------------------------------------ registry
+class TemplateRegistry:
+    """Caches cleaned, frozen templates keyed by problem name; reloads on mtime change."""
+    def __init__(self, templates_dir: str = TEMPLATES_DIR, bundle_path: str = TEMPLATE_BUNDLE):
+        self.templates_dir = templates_dir
+        self.bundle_path = bundle_path
+        self._bundle = None  # TemplateBundle, reopened when the file is rebuilt
+        self._entries = {}   # problem_name -> (mtime_ns, data)
+        self._lock = threading.Lock()
+
+    def bundle(self):
+        """The compiled bundle, or None if there is none (or it can't be read)."""
+        if not self.bundle_path:
+            return None
+        try:
+            mtime = os.stat(self.bundle_path).st_mtime_ns
+        except FileNotFoundError:
+            self._bundle = None
+            return None
+        if self._bundle is None or self._bundle.mtime_ns != mtime:
+            # The previous mapping stays alive for as long as templates loaded from it are in use
+            try:
+                self._bundle = TemplateBundle(self.bundle_path)
+            except (OSError, ValueError):
+                self._bundle = None
+        return self._bundle
+
+    def path_for(self, problem_name: str) -> str:
+        # Problem names come straight from the request body, never let them escape the directory
+        if not problem_name or os.path.basename(problem_name) != problem_name:
+            raise FileNotFoundError(f"Template {problem_name} not found")
+        return os.path.join(self.templates_dir, f"{problem_name}.json")
+
+    def names(self) -> list:
+        """All problem names that have a template on disk."""
+        return sorted(f[:-5] for f in os.listdir(self.templates_dir) if f.endswith(".json"))
+
+    def get(self, problem_name: str):
+        """Return the shared template for problem_name, (re)loading it if the file changed."""
+        path = self.path_for(problem_name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._entries.pop(problem_name, None)
+            raise FileNotFoundError(f"Template {problem_name} not found")
+        entry = self._entries.get(problem_name)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+        with self._lock:
+            # Another thread may have loaded it while we waited for the lock
+            entry = self._entries.get(problem_name)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+            bundle = self.bundle()
+            if bundle is not None and bundle.source_mtime(problem_name) == mtime:
+                data = LazyTemplate(bundle, problem_name, freeze)
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = freeze(clean_whitespace(json.load(f)))
+            self._entries[problem_name] = (mtime, data)
+            return data
+
+    def version(self, problem_name: str) -> int:
+        """mtime of the currently loaded copy; changes whenever the template is reloaded."""
+        self.get(problem_name)
+        return self._entries[problem_name][0]
+
+    def preload(self):
+        """Load every template up front so the first /start per problem pays nothing (bundled ones stay lazy)."""
+        for name in self.names():
+            self.get(name)
+
+
+registry = TemplateRegistry()
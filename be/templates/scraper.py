@@ -1,21 +1,104 @@
+"""
+scraper.py  –  Scrape problem-breakdown pages into interview templates.
+
+Usage:
+    python scraper.py                       # refresh every <slug>.json in this directory
+    python scraper.py uber tinder --workers 8
+    python scraper.py bitly --base-url http://localhost:8000   # local fixture server
+
+Pages are processed concurrently over one pooled HTTP session and each page's
+figures are fetched in parallel.  Every response is kept in an on-disk HTTP
+cache and revalidated with ETag / Last-Modified, so unchanged pages and
+figures cost a 304.  A template file is only rewritten when its content
+actually changed.
+"""
+
+import argparse, hashlib, io, json, os, threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-import json
-from svgtry import svg_to_graph
+from svggraph import svg_to_graph
+
+BASE_URL = "https://www.hellointerview.com"
+PAGE_PATH = "/learn/system-design/problem-breakdowns/{slug}"
+HERE = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(HERE, ".http_cache")
 
 # Prefixes that denote solution variants under an H3
 SPECIAL_PREFIXES = ("Bad Solution", "Good Solution", "Great Solution")
 
 
-def scrape_bitly_page(url):
+# ------------------------------------------------------------------ http
+def make_session(pool_size: int = 16) -> requests.Session:
+    """One keep-alive session shared by all workers, with retries on transient errors."""
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HTTPCache:
+    """On-disk cache of response bodies, revalidated with conditional GETs."""
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.stats = {"hit": 0, "miss": 0}
+        self._lock = threading.Lock()
+
+    def _paths(self, url: str):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json"), os.path.join(self.cache_dir, f"{key}.body")
+
+    def _write(self, path: str, data: bytes):
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def fetch(self, session: requests.Session, url: str) -> bytes:
+        """GET url, sending the cached validators; a 304 returns the cached body."""
+        meta_path, body_path = self._paths(url)
+        headers = {}
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if os.path.exists(body_path):
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        resp = session.get(url, headers=headers, timeout=30)
+        if resp.status_code == 304:
+            with self._lock:
+                self.stats["hit"] += 1
+            with open(body_path, "rb") as f:
+                return f.read()
+        resp.raise_for_status()
+        with self._lock:
+            self.stats["miss"] += 1
+        self._write(body_path, resp.content)
+        meta = {"url": url, "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+        self._write(meta_path, json.dumps(meta).encode("utf-8"))
+        return resp.content
+
+
+# ------------------------------------------------------------------ parsing
+def parse_page(html: str, fetch_figure, figure_workers: int = 8, base_url: str = BASE_URL):
     """
-    Fetches the Bitly design-breakdown page and returns nested JSON:
+    Parses a design-breakdown page and returns nested JSON:
       H2 titles -> {content: [], subsections: { H3: { content: [], <Solution>: { content: [], <H6>: { content: [] } } } }}
-    Embedded figures are captured in each dict under a 'figures' key.
+    Embedded figures are captured in each dict under a 'figures' key; `fetch_figure(url)` returns the
+    SVG bytes and all of a page's figures are fetched in parallel once the text has been parsed.
     """
-    resp = requests.get(url)
-    resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, "html.parser")
+    soup = BeautifulSoup(html, "html.parser")
+    pending = []   # (figure dict, absolute url) filled in after the parse
 
     data = {}
     current_h2 = None
@@ -53,7 +136,6 @@ def scrape_bitly_page(url):
         # H6: Approach/Challenges under H3 or its solution
         if el.name == "h6":
             text = el.get_text(strip=True)
-            print(text)
             x = ["Not sure where your gaps are?", "Questions", "Links", "Legal", "Contact"]
             if text in x:
                 continue
@@ -69,11 +151,7 @@ def scrape_bitly_page(url):
 
         # figures (SVG <object>)
         if el.name == "object":
-            src = el.get("data")
-            print(src)
-            URL = "https://www.hellointerview.com" + src
-            graph = svg_to_graph(URL)
-            src = graph
+            url = urljoin(base_url, el.get("data"))
             caption = el.get("aria-label", "")
             # pick container dict
             if h6_special:
@@ -88,7 +166,9 @@ def scrape_bitly_page(url):
             else:
                 container = data[current_h2]
             # store figures list
-            container.setdefault("figures", []).append({"src": src, "caption": caption})
+            figure = {"src": None, "caption": caption}
+            container.setdefault("figures", []).append(figure)
+            pending.append((figure, url))
             continue
 
         # lists
@@ -126,12 +206,74 @@ def scrape_bitly_page(url):
                     data[current_h2]["subsections"][current_h3]["content"].append(txt)
             continue
 
+    # Resolve every figure on the page in parallel (each distinct URL once)
+    urls = sorted({url for _, url in pending})
+    with ThreadPoolExecutor(max_workers=figure_workers) as pool:
+        graphs = dict(zip(urls, pool.map(lambda u: svg_to_graph(io.BytesIO(fetch_figure(u))), urls)))
+    for figure, url in pending:
+        figure["src"] = graphs[url]
+
     return data
 
 
+def scrape_bitly_page(url):
+    """Fetch and parse a single page without the cache (kept for one-off use)."""
+    resp = requests.get(url)
+    resp.raise_for_status()
+    return parse_page(resp.text, lambda u: requests.get(u).content)
+
+
+# ------------------------------------------------------------------ batch
+def scrape_one(slug: str, session, cache: HTTPCache, out_dir: str, base_url: str, figure_workers: int) -> str:
+    """Scrape one problem and write <slug>.json if it changed. Returns "written", "unchanged" or "new"."""
+    fetch = lambda url: cache.fetch(session, url)
+    html = fetch(urljoin(base_url, PAGE_PATH.format(slug=slug))).decode("utf-8")
+    result = parse_page(html, fetch, figure_workers, base_url)
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    path = os.path.join(out_dir, f"{slug}.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == text:
+                return "unchanged"
+        status = "written"
+    except FileNotFoundError:
+        status = "new"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return status
+
+
+def scrape_all(slugs: list, out_dir: str = HERE, base_url: str = BASE_URL, workers: int = 4,
+               figure_workers: int = 8, cache_dir: str = CACHE_DIR) -> dict:
+    """Scrape every slug concurrently; returns {slug: status or error string}."""
+    session = make_session(pool_size=workers * figure_workers)
+    cache = HTTPCache(cache_dir)
+
+    def run(slug):
+        try:
+            return scrape_one(slug, session, cache, out_dir, base_url, figure_workers)
+        except Exception as err:
+            return f"error: {err}"
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = dict(zip(slugs, pool.map(run, slugs)))
+    results["_cache"] = dict(cache.stats)
+    return results
+
+
 if __name__ == "__main__":
-    URL = "https://www.hellointerview.com/learn/system-design/problem-breakdowns/whatsapp"
-    result = scrape_bitly_page(URL)
-    with open("whatsapp.json", "w", encoding="utf-8") as f:
-        json.dump(result, f, indent=2, ensure_ascii=False)
-    # print(json.dumps(result, indent=2, ensure_ascii=False))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scrape problem breakdowns into templates/<slug>.json")
+    parser.add_argument("slugs", nargs="*", help="problems to scrape (default: every existing template)")
+    parser.add_argument("--base-url", default=BASE_URL, help="site root, e.g. a local fixture server")
+    parser.add_argument("--out-dir", default=HERE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=4, help="pages scraped at once")
+    parser.add_argument("--figure-workers", type=int, default=8, help="figures fetched at once per page")
+    args = parser.parse_args()
+
+    slugs = args.slugs or sorted(f[:-5] for f in os.listdir(args.out_dir) if f.endswith(".json"))
+    results = scrape_all(slugs, args.out_dir, args.base_url, args.workers, args.figure_workers, args.cache_dir)
+    cache_stats = results.pop("_cache")
+    for slug, status in results.items():
+        print(f"{slug:<24} {status}")
+    print(f"http cache: {cache_stats['hit']} revalidated, {cache_stats['miss']} downloaded")
@@ -3,18 +3,28 @@ svg_to_graph.py  –  Parse an SVG diagram (rects / paths / text) into
                     an LLM-friendly {"nodes":[…], "edges":[…]} structure.
 
 Usage:
-    python svg_to_graph.py path/to/diagram.svg > graph.json
+    python svggraph.py path/to/diagram.svg > graph.json
+    python svggraph.py https://example.com/diagram.svg
+    python svggraph.py --batch svg_dir/ out_dir/ [--workers 8]
+
+The document is read with iterparse, so large SVGs are never held as a full
+tree, and arrow endpoints are resolved to their nearest label through a
+uniform grid instead of scanning every node.
 """
 
-import json, math, sys, uuid, requests
+import argparse, io, json, math, os, re, sys, uuid
 import xml.etree.ElementTree as ET
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 # ------------------------------------------------------------------ helpers
 PT        = namedtuple("PT", "x y")
 Node      = namedtuple("Node", "id label cx cy")
 Edge      = namedtuple("Edge", "src dst")
 
+NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
 def center(elem):
     """Return the visual centre of <rect>, <ellipse>, <path> bounding-box."""
     bb = elem.attrib
@@ -35,49 +45,106 @@ def nearest_node(pt, nodes):
     return min(nodes, key=lambda n: math.hypot(n.cx-pt.x, n.cy-pt.y))
 
 
+class NodeGrid:
+    """
+    Uniform grid over node centres for nearest-node queries.
+    Cells are sized so each holds about one node; a query scans rings of cells outward
+    and stops once no unvisited cell can hold anything closer than the best match.
+    Ties go to the earliest node, exactly like `nearest_node`.
+    """
+    def __init__(self, nodes: list):
+        self.nodes = nodes
+        xs = [n.cx for n in nodes]
+        ys = [n.cy for n in nodes]
+        self.min_x, self.min_y = min(xs), min(ys)
+        span = max(max(xs) - self.min_x, max(ys) - self.min_y, 1.0)
+        self.size = span / max(1, math.isqrt(len(nodes)))
+        self.cells = {}
+        for i, n in enumerate(nodes):
+            self.cells.setdefault(self._cell(n.cx, n.cy), []).append(i)
+        self.cols = int((max(xs) - self.min_x) // self.size) + 1
+        self.rows = int((max(ys) - self.min_y) // self.size) + 1
+
+    def _cell(self, x: float, y: float):
+        return int((x - self.min_x) // self.size), int((y - self.min_y) // self.size)
+
+    def _ring(self, cx: int, cy: int, ring: int):
+        """Grid cells at Chebyshev distance `ring` from (cx, cy), clipped to the grid."""
+        if ring == 0:
+            yield cx, cy
+            return
+        xs = range(max(cx - ring, 0), min(cx + ring, self.cols - 1) + 1)
+        for gy in (cy - ring, cy + ring):
+            if 0 <= gy < self.rows:
+                for gx in xs:
+                    yield gx, gy
+        ys = range(max(cy - ring + 1, 0), min(cy + ring - 1, self.rows - 1) + 1)
+        for gx in (cx - ring, cx + ring):
+            if 0 <= gx < self.cols:
+                for gy in ys:
+                    yield gx, gy
+
+    def nearest(self, pt):
+        cx, cy = self._cell(pt.x, pt.y)
+        best = None   # (distance, index)
+        # Points outside the grid start at the first ring that touches it
+        ring = max(0, -cx, cx - self.cols + 1, -cy, cy - self.rows + 1)
+        last = max(cx, self.cols - 1 - cx, cy, self.rows - 1 - cy)
+        while ring <= last:
+            for cell in self._ring(cx, cy, ring):
+                for i in self.cells.get(cell, ()):
+                    n = self.nodes[i]
+                    cand = (math.hypot(n.cx - pt.x, n.cy - pt.y), i)
+                    if best is None or cand < best:
+                        best = cand
+            # Every cell beyond this ring is at least `ring * size` away from pt
+            if best is not None and best[0] < ring * self.size:
+                break
+            ring += 1
+        return self.nodes[best[1]]
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
 # ------------------------------------------------------------------ main
-def svg_to_graph(svg_path: str):
-    tree = ET.parse(svg_path)
-    root = tree.getroot()
-
-    # namespaces in InkScape / Excalidraw exports
-    ns = {"svg": root.tag.split("}")[0].strip("{")}
-
-    ### 1. grab <text> to create nodes  ------------------------------
-    nodes = []
-    for t in root.findall(".//svg:text", ns):
-        label = "".join(t.itertext()).strip()
-        if not label:       # skip empty
-            continue
-        # use parent element's centre if exists, else text's x/y
-        parent = t.getparent() if hasattr(t, "getparent") else None
-        cx, cy = (center(parent) if parent is not None else
-                  (float(t.attrib.get("x", 0)), float(t.attrib.get("y", 0))))
-        nid = label.lower().replace(" ", "_").replace("-", "")
-        nodes.append(Node(id=nid or str(uuid.uuid4())[:8],
-                          label=label, cx=cx, cy=cy))
-
-    ### 2. grab <path> / <line> arrows to create edges ---------------
-    paths = root.findall(".//svg:path", ns) + root.findall(".//svg:line", ns)
-    edges = []
-    for p in paths:
-        bb = p.attrib
-        # we consider only *straight* first & last points for rough direction
-        if "d" in bb:                               # path
-            coords = [float(n) for n in bb["d"].replace("M","").replace("L"," ").split()]
-            if len(coords) >= 4:
-                start = PT(coords[0], coords[1])
-                end   = PT(coords[-2], coords[-1])
-            else:
+def svg_to_graph(svg_path):
+    """Convert an SVG (path or binary file object) into {"nodes": [...], "edges": [...]}."""
+    nodes, segments = [], []
+
+    ### 1. stream the document: <text> make nodes, <path>/<line> arrows make edges
+    for _, el in ET.iterparse(svg_path, events=("end",)):
+        kind = _local(el.tag)
+        if kind == "text":
+            label = "".join(el.itertext()).strip()
+            cx, cy = float(el.attrib.get("x", 0) or 0), float(el.attrib.get("y", 0) or 0)
+            el.clear()
+            if not label:       # skip empty
                 continue
-        else:                                       # line
-            start = PT(float(bb["x1"]), float(bb["y1"]))
-            end   = PT(float(bb["x2"]), float(bb["y2"]))
-
-        src = nearest_node(start, nodes).id
-        dst = nearest_node(end,   nodes).id
-        if src != dst:                              # skip loops
-            edges.append(Edge(src, dst))
+            nid = label.lower().replace(" ", "_").replace("-", "")
+            nodes.append(Node(id=nid or str(uuid.uuid4())[:8],
+                              label=label, cx=cx, cy=cy))
+        elif kind in ("path", "line"):
+            bb = el.attrib
+            # we consider only *straight* first & last points for rough direction
+            if kind == "path":
+                coords = [float(n) for n in NUMBER.findall(bb.get("d", ""))]
+                if len(coords) >= 4:
+                    segments.append((PT(coords[0], coords[1]), PT(coords[-2], coords[-1])))
+            elif all(k in bb for k in ("x1", "y1", "x2", "y2")):
+                segments.append((PT(float(bb["x1"]), float(bb["y1"])), PT(float(bb["x2"]), float(bb["y2"]))))
+            el.clear()
+
+    ### 2. resolve arrow endpoints to their nearest labels -----------
+    edges = []
+    if nodes:
+        grid = NodeGrid(nodes)
+        for start, end in segments:
+            src = grid.nearest(start).id
+            dst = grid.nearest(end).id
+            if src != dst:                              # skip loops
+                edges.append(Edge(src, dst))
 
     # dedupe edges
     edges = list({(e.src, e.dst): e for e in edges}.values())
@@ -96,9 +163,45 @@ def svg_to_graph(svg_path: str):
     return graph
 
 
+# ------------------------------------------------------------------ batch
+def _convert_file(paths):
+    src, dst = paths
+    try:
+        graph = svg_to_graph(src)
+    except (ET.ParseError, ValueError) as err:
+        return src, f"error: {err}"
+    with open(dst, "w", encoding="utf-8") as f:
+        json.dump(graph, f, indent=2)
+    return src, f"{len(graph['nodes'])} nodes, {len(graph['edges'])} edges"
+
+
+def convert_directory(in_dir: str, out_dir: str, workers: int = None) -> dict:
+    """Convert every *.svg in in_dir to out_dir/<name>.json on a process pool."""
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [
+        (os.path.join(in_dir, f), os.path.join(out_dir, f[:-4] + ".json"))
+        for f in sorted(os.listdir(in_dir)) if f.lower().endswith(".svg")
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(_convert_file, jobs, chunksize=4))
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        sys.exit("Usage: python svg_to_graph.py diagram.svg")
-    x = requests.get(sys.argv[1])
-    graph = svg_to_graph(x)
-    print(json.dumps(graph, indent=2))
+    parser = argparse.ArgumentParser(description="Convert SVG diagrams to {nodes, edges} graphs")
+    parser.add_argument("source", help="SVG file or URL, or the input directory with --batch")
+    parser.add_argument("out_dir", nargs="?", help="output directory (with --batch)")
+    parser.add_argument("--batch", action="store_true", help="convert a whole directory")
+    parser.add_argument("--workers", type=int, default=None, help="processes for --batch (default: CPU count)")
+    args = parser.parse_args()
+
+    if args.batch:
+        if not args.out_dir:
+            sys.exit("Usage: python svggraph.py --batch svg_dir out_dir")
+        for src, status in convert_directory(args.source, args.out_dir, args.workers).items():
+            print(f"{src}: {status}")
+    else:
+        source = args.source
+        if source.startswith(("http://", "https://")):
+            import requests
+            source = io.BytesIO(requests.get(source).content)
+        print(json.dumps(svg_to_graph(source), indent=2))
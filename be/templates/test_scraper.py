@@ -0,0 +1,108 @@
+"""
+scraper.py against a local fixture server: a second run revalidates every page and figure with
+a conditional GET and gets 304s, and a page edit is picked up.  Run from be/: python -m pytest -q
+"""
+
+import hashlib, json, os, threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from scraper import PAGE_PATH, scrape_all
+
+PAGE = """<html><body>
+<h2>High-Level Design</h2>
+<p>Start with the write path.</p>
+<h3>1) Users can shorten a URL</h3>
+<p>The API server stores the mapping.</p>
+<object data="/figures/{figure}.svg" aria-label="Write path"></object>
+</body></html>"""
+FIGURE = (b'<svg xmlns="http://www.w3.org/2000/svg">'
+          b'<rect x="0" y="0" width="40" height="20"/><text x="5" y="10">API Gateway</text>'
+          b'<rect x="100" y="0" width="40" height="20"/><text x="105" y="10">Database</text></svg>')
+LAST_MODIFIED = formatdate(0, usegmt=True)
+
+
+class FixtureSite(ThreadingHTTPServer):
+    """Serves one page (validated by ETag) and one figure (validated by Last-Modified), logging each status."""
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.page = PAGE.format(figure="write-path").encode("utf-8")
+        self.log = []   # (path, status) per request
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        site = self.server
+        if self.path == PAGE_PATH.format(slug="fixture"):
+            body, content_type = site.page, "text/html"
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            fresh = self.headers.get("If-None-Match") == etag
+            validators = {"ETag": etag}
+        elif self.path.startswith("/figures/"):
+            body, content_type = FIGURE, "image/svg+xml"
+            fresh = self.headers.get("If-Modified-Since") == LAST_MODIFIED
+            validators = {"Last-Modified": LAST_MODIFIED}
+        else:
+            site.log.append((self.path, 404))
+            self.send_error(404)
+            return
+        status = 304 if fresh else 200
+        site.log.append((self.path, status))
+        self.send_response(status)
+        for name, value in validators.items():
+            self.send_header(name, value)
+        if fresh:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site(monkeypatch):
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+    server = FixtureSite()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_second_run_revalidates_with_304(site, tmp_path):
+    run = lambda: scrape_all(["fixture"], out_dir=str(tmp_path), base_url=site.url, workers=1, figure_workers=2,
+                             cache_dir=str(tmp_path / "cache"))
+
+    first = run()
+    assert first["fixture"] == "new"
+    assert first["_cache"] == {"hit": 0, "miss": 2}
+    with open(tmp_path / "fixture.json", encoding="utf-8") as f:
+        template = json.load(f)
+    figure = template["High-Level Design"]["subsections"]["1) Users can shorten a URL"]["figures"][0]
+    assert [n["label"] for n in figure["src"]["nodes"]] == ["API Gateway", "Database"]
+    written = os.path.getmtime(tmp_path / "fixture.json")
+
+    # Nothing changed: both requests are conditional, nothing is downloaded and the file is left alone
+    site.log.clear()
+    second = run()
+    assert second["fixture"] == "unchanged"
+    assert second["_cache"] == {"hit": 2, "miss": 0}
+    assert sorted(status for _, status in site.log) == [304, 304]
+    assert os.path.getmtime(tmp_path / "fixture.json") == written
+
+    # The page changes: its ETag no longer matches, so it is downloaded again and the template rewritten
+    site.page = site.page.replace(b"stores the mapping", b"stores the short code mapping")
+    site.log.clear()
+    third = run()
+    assert third["fixture"] == "written"
+    assert third["_cache"] == {"hit": 1, "miss": 1}
+    assert sorted(status for _, status in site.log) == [200, 304]
@@ -0,0 +1,138 @@
+"""
+Breaker, retry and hedging behaviour of resilience.py, driven by the stub backend's fault
+injection through llm.complete (and resilience.stream for streams).  Run from be/: python -m pytest -q
+"""
+
+import asyncio, time
+import pytest
+import llm, resilience
+from llm import InjectedFault, StubBackend
+from resilience import CircuitBreaker, CircuitOpen, DeadlineExceeded
+
+MESSAGES = [{"role": "system", "content": "test"}, {"role": "user", "content": "hello"}]
+
+
+class Rolls:
+    """Scripted stand-in for the stub's fault RNG: each call takes the next roll."""
+    def __init__(self, *rolls):
+        self.rolls = list(rolls)
+
+    def random(self):
+        return self.rolls.pop(0) if self.rolls else 1.0
+
+
+class CountingStub(StubBackend):
+    """Fast stub that records which model every attempt went to."""
+    def __init__(self, **faults):
+        super().__init__(latency_ms=1, latency_sigma=0, tokens_per_sec=100000, reply_tokens=5, advance_every=0,
+                         **faults)
+        self.attempts = []
+
+    async def complete(self, messages, *, model, **kw):
+        self.attempts.append(model)
+        return await super().complete(messages, model=model, **kw)
+
+    async def stream(self, messages, *, model, **kw):
+        self.attempts.append(model)
+        async for token in super().stream(messages, model=model, **kw):
+            yield token
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    """Fresh breakers and latency samples per test, no backoff sleeps and no hedging unless asked for."""
+    monkeypatch.setattr(resilience, "breakers", {})
+    monkeypatch.setattr(resilience, "latencies", resilience.LatencyTracker())
+    monkeypatch.setattr(resilience, "LLM_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(resilience, "LLM_HEDGE", False)
+    monkeypatch.setattr(resilience, "LLM_FALLBACK_MODEL", "")
+    yield
+    llm.set_backend(None)
+
+
+def use(backend):
+    llm.set_backend(backend)
+    return backend
+
+
+def complete(model: str = "primary", **kw):
+    return asyncio.run(llm.complete(MESSAGES, model=model, coalesce=False, **kw))
+
+
+def test_retries_until_exhausted():
+    stub = use(CountingStub(error_rate=1.0))
+    with pytest.raises(InjectedFault):
+        complete()
+    assert len(stub.attempts) == resilience.LLM_RETRIES + 1
+
+
+def test_transient_error_is_retried():
+    stub = use(CountingStub(error_rate=0.5))
+    stub._faults = Rolls(0.1, 0.9)    # first attempt fails, the retry goes through
+    assert complete()
+    assert len(stub.attempts) == 2
+    assert resilience.breaker("primary").state == "closed"
+
+
+def test_breaker_opens_then_half_opens_with_one_probe():
+    # Trips on the last attempt of the first call
+    resilience.breakers["primary"] = CircuitBreaker(threshold=resilience.LLM_RETRIES + 1, cooldown=0.2)
+    stub = use(CountingStub(failing_models={"primary"}))
+    with pytest.raises(InjectedFault):
+        complete()
+    assert resilience.breaker("primary").state == "open"
+
+    # Open: calls are refused without reaching the model
+    attempts = len(stub.attempts)
+    with pytest.raises(CircuitOpen):
+        complete()
+    assert len(stub.attempts) == attempts
+
+    # Half-open after the cooldown: a failed probe opens it again straight away
+    time.sleep(0.25)
+    assert resilience.breaker("primary").state == "half-open"
+    with pytest.raises(CircuitOpen):
+        complete()
+    assert len(stub.attempts) == attempts + 1
+    assert resilience.breaker("primary").state == "open"
+
+    # Once the model recovers, the next probe closes it
+    time.sleep(0.25)
+    stub.failing_models.clear()
+    assert complete()
+    assert resilience.breaker("primary").state == "closed"
+
+
+def test_open_breaker_fails_over(monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_FALLBACK_MODEL", "fallback")
+    resilience.breakers["primary"] = CircuitBreaker(threshold=1, cooldown=60)
+    stub = use(CountingStub(failing_models={"primary"}))
+    assert complete()
+    assert stub.attempts == ["primary", "fallback"]
+
+
+def test_hedge_wins_over_a_hung_request(monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_HEDGE", True)
+    monkeypatch.setattr(resilience, "LLM_HEDGE_DELAY", "0.05")
+    stub = use(CountingStub(hang_rate=0.5, hang_seconds=5))
+    stub._faults = Rolls(0.1, 0.9)    # the first request hangs, the hedge doesn't
+    hedges = dict(resilience.LLM_HEDGES_TOTAL.values)
+    started = time.monotonic()
+    assert complete()
+    assert time.monotonic() - started < 1
+    assert len(stub.attempts) == 2
+    key = (("purpose", "interview"), ("winner", "hedge"))
+    assert resilience.LLM_HEDGES_TOTAL.values.get(key, 0) == hedges.get(key, 0) + 1
+
+
+def test_silent_stream_is_retried_then_times_out():
+    stub = use(CountingStub(hang_rate=1.0, hang_seconds=5))
+
+    async def consume():
+        open_stream = lambda target: stub.stream(MESSAGES, model=target, temperature=0, max_tokens=10, usage={})
+        return [t async for t in resilience.stream(open_stream, model="primary", purpose="interview",
+                                                   first_token_timeout=0.05)]
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(consume())
+    assert len(stub.attempts) == resilience.LLM_RETRIES + 1
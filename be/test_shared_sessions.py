@@ -0,0 +1,40 @@
+"""
+Compare-and-set of the shared session store (shared_sessions.py) on the SQLite backend.  Run from be/: python -m pytest -q
+"""
+
+import asyncio
+import pytest
+from app2 import SessionState
+from shared_sessions import SessionConflict, SharedSessionStore, SQLiteBackend
+
+USER = "candidate"
+
+
+async def start(store: SharedSessionStore, problem_name: str) -> SessionState:
+    """What /start does: create the session, then save it with the greeting."""
+    session = SessionState(problem_name, store.new_archive(USER))
+    await store.create(USER, session)
+    session.history = [{"role": "assistant", "content": f"Let's design {problem_name}."}]
+    await store.save(USER, session)
+    return session
+
+
+def test_restart_invalidates_a_copy_loaded_before_it(tmp_path):
+    store = SharedSessionStore(SQLiteBackend(str(tmp_path / "sessions.db")), SessionState.from_dict)
+
+    async def scenario():
+        await start(store, "uber")
+        # Worker B loads the session for a turn...
+        stale = await store.load(USER)
+        # ...worker A restarts the interview on another problem in the meantime...
+        restarted = await start(store, "bitly")
+        assert restarted.version > stale.version
+        # ...and B's turn, finishing last, must not bring the old interview back
+        stale.history.append({"role": "user", "content": "I would start with the rider app."})
+        with pytest.raises(SessionConflict):
+            await store.save(USER, stale)
+        session = await store.load(USER)
+        assert session.problem_name == "bitly"
+        assert session.history == restarted.history
+
+    asyncio.run(scenario())
@@ -1,7 +1,7 @@
 import React, { useState, useEffect, useRef } from "react";
 import { useRecoilValue } from "recoil";
 import { graph } from "../atoms/graph";
-import { processData } from "../utility/graph";
+import { compactElements } from "../utility/graph";
 import StageSelector from "./Stage";
 import { User, Bot, Send } from "lucide-react";
 import ReactMarkdown from "react-markdown";
@@ -56,20 +56,58 @@ export default function ChatBox({
     setLoading(true);
 
     try {
-        // normal interact
+        // streaming interact: tokens arrive as SSE frames, the last one carries nextStage
         const payload = {
           user_id: userId,
           message: text,
-          graph: processData(elements),
+          elements: compactElements(elements),
         };
-        const res = await fetch(`${API_BASE}/interact`, {
+        const res = await fetch(`${API_BASE}/interact/stream`, {
           method:  "POST",
           headers: { "Content-Type": "application/json" },
           body:    JSON.stringify(payload),
         });
-        const { reply, nextStage } = await res.json();
-        setStage(nextStage);
-        setMessages(m => [...m, { sender: "bot", text: reply }]);
+        if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+        let started = false;
+        const appendToken = token => {
+          if (!started) {
+            started = true;
+            setLoading(false);
+            setMessages(m => [...m, { sender: "bot", text: token }]);
+          } else {
+            setMessages(m => [
+              ...m.slice(0, -1),
+              { ...m[m.length - 1], text: m[m.length - 1].text + token },
+            ]);
+          }
+        };
+
+        const reader  = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          let sep;
+          while ((sep = buffer.indexOf("\n\n")) !== -1) {
+            const frame = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            const event = frame.match(/^event: (.*)$/m)?.[1];
+            const data  = JSON.parse(frame.match(/^data: (.*)$/m)?.[1] ?? "{}");
+            if (event === "token") {
+              appendToken(data.text);
+            } else if (event === "done") {
+              setStage(data.nextStage);
+              // The recorded reply wins over what was streamed (trimmed, or raw text if JSON parsing failed)
+              if (!started) appendToken(data.reply);
+              else setMessages(m => [...m.slice(0, -1), { ...m[m.length - 1], text: data.reply }]);
+            } else if (event === "error") {
+              throw new Error(data.detail);
+            }
+          }
+        }
     } catch {
       setMessages(m => [...m, { sender: "bot", text: "Error contacting AI." }]);
     } finally {
@@ -71,4 +71,23 @@ export const processData = (elements) => {
     });
     console.log(val)
     return val;
-  };
\ No newline at end of file
+  };
+
+// Only the fields the server-side normalizer reads; layout, styling and
+// rendering state stay in the browser.
+export const compactElements = (elements) =>
+  elements
+    .filter((x) => !x.isDeleted)
+    .map((x) => ({
+      id: x.id,
+      type: x.type,
+      version: x.version,
+      x: x.x,
+      y: x.y,
+      width: x.width,
+      height: x.height,
+      text: x.type === "text" ? x.text : undefined,
+      containerId: x.containerId ?? undefined,
+      startBinding: x.startBinding ? { elementId: x.startBinding.elementId } : undefined,
+      endBinding: x.endBinding ? { elementId: x.endBinding.elementId } : undefined,
+    }));